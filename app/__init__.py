@@ -6,18 +6,42 @@ from flask_sqlalchemy import SQLAlchemy
 
 engine = Flask("app")
 
-engine.config["DEBUG"] = True
-
-# Restfull response json configurations
-engine.config["JSON_AS_ASCII"] = False
-engine.config["JSONIFY_PRETTYPRINT_REGULAR"] = False
-
-# Database configurations
-engine.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///{}".format(os.path.join(engine.root_path, "ecommerce.db"))
-engine.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Profile picked by APP_ENV ("dev" or "prod"), APP_SETTINGS may point to
+# a python file overriding single values
+from .config import profiles
+engine.config.from_object(profiles[os.environ.get("APP_ENV", "dev")])
+engine.config.from_envvar("APP_SETTINGS", silent=True)
+
+if not engine.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    engine.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+        "pool_size": engine.config["DB_POOL_SIZE"],
+        "max_overflow": engine.config["DB_MAX_OVERFLOW"],
+        "pool_recycle": engine.config["DB_POOL_RECYCLE"],
+        "pool_timeout": engine.config["DB_POOL_TIMEOUT"],
+        "pool_pre_ping": True
+    })
 
 db = SQLAlchemy(engine)
 
+# Compiled templates are kept on disk, keyed by the checksum of their source,
+# in the folder "./run build" creates
+if engine.config["TEMPLATE_CACHE_DIR"] and os.path.isdir(engine.config["TEMPLATE_CACHE_DIR"]):
+    from jinja2 import FileSystemBytecodeCache
+    engine.jinja_env.bytecode_cache = FileSystemBytecodeCache(engine.config["TEMPLATE_CACHE_DIR"])
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    import sqlite3
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in engine.config["SQLITE_PRAGMAS"].items():
+        cursor.execute("PRAGMA {} = {}".format(name, value))
+    cursor.close()
+
 # Login
 AUTH_KEY = '#Im$nw#u=6eAU>qk6=lZJPa2T,n.~cu/soIF^3|?V4xCAzKjKL-<mA!H$1JD::i'
 AUTH_COOKIE_NAME = 'm48CFwYC5e'
@@ -28,4 +52,9 @@ IMAGE_FOLDER = os.path.join(engine.root_path, "static", "images")
 THUMBNAIL_FOLDER = os.path.join(engine.root_path, "static", "thumbnails")
 UPLOAD_FOLDER = os.path.join(engine.root_path, "static", "products")
 
+# Models with change hooks
+from .models import related, cart, pricing, user
+from . import versions, thumbnails, manifest, pagecache, fulltext, metrics, options
+manifest.load_manifest()
+
 from .views import *
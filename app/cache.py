@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import OrderedDict
+
+# Every cache created in the process, so they can be dropped at once
+_caches = []
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._items = OrderedDict()
+        _caches.append(self)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self.lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self._items.pop(key, None)
+        if item is None:
+            return default
+        return item[0]
+
+    def prune(self, fn):
+        # Drops every entry for which fn(key, value) is true
+        with self.lock:
+            for key in [k for k, v in self._items.items() if fn(k, v[0])]:
+                del self._items[key]
+
+    def clear(self):
+        with self.lock:
+            self._items.clear()
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._items)
+
+def clear_all():
+    for cache in _caches:
+        cache.clear()
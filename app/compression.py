@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+
+# Preferred first, brotli only when the package is installed
+ENCODINGS = ["br", "gzip"]
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+# Static files worth compressing, images are compressed already
+COMPRESSIBLE = (".css", ".js", ".json", ".svg", ".txt", ".html", ".xml", ".ico", ".map")
+
+# Levels per encoding, pages compressed on the request path use fast ones,
+# the build step takes its time for the smallest files
+FAST = {"br": 5, "gzip": 6}
+BEST = {"br": 11, "gzip": 9}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def available_encodings():
+    return [v for v in ENCODINGS if v != "br" or brotli is not None]
+
+def accepted_encodings(req):
+    return [v for v in available_encodings() if req.accept_encodings.quality(v) > 0]
+
+def compress(data, encoding, levels=FAST):
+    if encoding == "br":
+        return brotli.compress(data, quality=levels["br"])
+    # mtime 0 keeps the output the same for the same input
+    return gzip.compress(data, levels["gzip"], mtime=0)
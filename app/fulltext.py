@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import bisect
+import threading
+from app import engine, db
+from .models.product import Product, on_change
+from . import versions
+
+FTS_TABLE = "products_fts"
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END"""
+]
+
+def query_terms(q):
+    return re.findall(r"\w+", q.lower())[:10]
+
+def is_fts5(bind):
+    if bind.dialect.name != "sqlite":
+        return False
+    return bool(bind.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)).scalar())
+
+def create_search_index(db):
+    # The triggers keep the index in step with every write, bulk imports
+    # included, so nothing in the application has to maintain it
+    if db.engine.dialect.name != "sqlite":
+        return False
+    for sql in FTS_SCHEMA:
+        db.session.execute(sql)
+    db.session.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    db.session.commit()
+    return True
+
+class Fts5Search(object):
+    def search(self, q, offset, limit):
+        terms = query_terms(q)
+        if not terms:
+            return []
+        # Every term must match, the last one as a prefix for type-ahead
+        match = " ".join('"{}"'.format(v) for v in terms[:-1])
+        match = (match + ' "{}"*'.format(terms[-1])).strip()
+        rows = db.session.execute(
+            "SELECT rowid FROM products_fts WHERE products_fts MATCH :match "
+            "ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset",
+            {"match": match, "limit": limit, "offset": offset})
+        return [v[0] for v in rows]
+
+class InvertedIndexSearch(object):
+    # For backends without FTS5, an in-process index rebuilt lazily after
+    # a product write in any worker, or once it is SEARCH_INDEX_TTL old
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.words = []
+        self.built = 0
+
+    def build(self):
+        from .models.related import tokenize
+        index = {}
+        for v in db.session.query(Product.id, Product.name, Product.description).yield_per(1000):
+            for tokens, weight in [(tokenize(v.name), 10), (tokenize(v.description), 1)]:
+                for token in tokens:
+                    postings = index.setdefault(token, {})
+                    postings[v.id] = postings.get(v.id, 0) + weight
+        return index
+
+    def search(self, q, offset, limit):
+        from unidecode import unidecode
+        terms = re.findall(r"[a-z0-9]+", unidecode(q).lower())[:10]
+        if not terms:
+            return []
+        with self.lock:
+            if self.index is None or time.time() - self.built > engine.config["SEARCH_INDEX_TTL"]:
+                self.index = self.build()
+                self.words = sorted(self.index)
+                self.built = time.time()
+            index = self.index
+            words = self.words
+
+        # Every term must match, the last one as a prefix for type-ahead
+        scores = None
+        for number, term in enumerate(terms, 1):
+            keys = [term]
+            if number == len(terms):
+                # Words starting with the term are a run of the sorted list
+                keys = []
+                start = bisect.bisect_left(words, term)
+                while start < len(words) and words[start].startswith(term):
+                    keys.append(words[start])
+                    start = start + 1
+            postings = {}
+            for key in keys:
+                for id, weight in index.get(key, {}).items():
+                    postings[id] = postings.get(id, 0) + weight
+            if scores is None:
+                scores = postings
+            else:
+                scores = dict((id, scores[id] + w) for id, w in postings.items() if id in scores)
+
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return [id for id, score in ranked[offset:offset + limit]]
+
+    def invalidate(self):
+        with self.lock:
+            self.index = None
+
+_backend = None
+_fallback = InvertedIndexSearch()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = Fts5Search() if is_fts5(db.engine) else _fallback
+    return _backend
+
+def search_products(q, page=1, limit=20):
+    ids = get_backend().search(q, (page - 1) * limit, limit + 1)
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    if not ids:
+        return [], False
+
+    rows = dict((v.id, v) for v in Product.query.filter(Product.id.in_(ids)).all())
+    return [rows[id] for id in ids if id in rows], has_more
+
+@versions.watch("catalog")
+def forget_search():
+    _fallback.invalidate()
+
+@on_change
+def invalidate_search(products, action):
+    _fallback.invalidate()
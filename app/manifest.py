@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+from .models.product import on_change
+
+# "products/name.jpg" -> {"hash", "mtime", "size"}, loaded from the
+# manifest file built at deploy and completed lazily for new files
+_entries = {}
+
+def get_folders():
+    from app import IMAGE_FOLDER, UPLOAD_FOLDER
+    return {
+        "images": IMAGE_FOLDER,
+        "products": UPLOAD_FOLDER
+    }
+
+def load_manifest():
+    from app import engine
+    try:
+        with open(engine.config["ASSET_MANIFEST"]) as f:
+            _entries.update(json.load(f))
+    except (IOError, ValueError):
+        pass
+    return len(_entries)
+
+def save_manifest():
+    from app import engine
+    path = engine.config["ASSET_MANIFEST"]
+    temp = "{}.tmp".format(path)
+    with open(temp, "w") as f:
+        json.dump(_entries, f, sort_keys=True)
+    os.replace(temp, path)
+
+def file_hash(folder, filename):
+    # Content hash of a file, only recomputed when its size or mtime moved
+    from werkzeug.security import safe_join
+    path = safe_join(get_folders()[folder], filename)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = "{}/{}".format(folder, filename)
+    entry = _entries.get(key)
+    if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["hash"]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+
+    entry = {
+        "hash": digest.hexdigest()[:16],
+        "mtime": stat.st_mtime,
+        "size": stat.st_size
+    }
+    _entries[key] = entry
+
+    return entry["hash"]
+
+def build_manifest():
+    count = 0
+    for folder, root in get_folders().items():
+        for base, dirs, files in os.walk(root):
+            for name in files:
+                filename = os.path.relpath(os.path.join(base, name), root).replace(os.sep, "/")
+                if file_hash(folder, filename) is not None:
+                    count = count + 1
+    save_manifest()
+    return count
+
+@on_change
+def refresh_manifest(products, action):
+    if action == "remove":
+        return
+    for v in products:
+        if v.image:
+            file_hash("products", v.image)
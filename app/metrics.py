@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import threading
+from app import engine
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Counters of the worker process. With METRICS_DIR set, which "./run serve"
+# does, every worker writes them to a file of its own at most once a
+# second and a scrape adds up the files of all workers, past ones included,
+# so the series never go backwards. Files of workers that exited are folded
+# into retired.json, the folder holds one file per running worker
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+slow_log = logging.getLogger("app.sql")
+if engine.config["SLOW_QUERY_LOG"]:
+    slow_log.addHandler(logging.FileHandler(engine.config["SLOW_QUERY_LOG"]))
+    slow_log.setLevel(logging.WARNING)
+
+class Histogram(object):
+    def __init__(self, buckets, counts=None, sum=0, count=0):
+        self.buckets = buckets
+        self.counts = list(counts) if counts else [0] * (len(buckets) + 1)
+        self.sum = sum
+        self.count = count
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def dump(self):
+        return [self.counts, self.sum, self.count]
+
+    def lines(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, total)
+        yield "{}_sum{{{}}} {}".format(name, labels, self.sum)
+        yield "{}_count{{{}}} {}".format(name, labels, self.count)
+
+_lock = threading.Lock()
+_latency = {}
+_queries = {}
+_query_time = {}
+_responses = {}
+_slow_queries = 0
+_name = None
+_dumped = 0
+
+def worker_name():
+    import uuid
+    return "{}-{}".format(os.getpid(), uuid.uuid4().hex[:8])
+
+def reset():
+    global _slow_queries, _name, _dumped
+    with _lock:
+        _latency.clear()
+        _queries.clear()
+        _query_time.clear()
+        _responses.clear()
+        _slow_queries = 0
+        _name = None
+        _dumped = 0
+
+def to_snapshot(latency, queries, query_time, responses, slow_queries):
+    return {
+        "latency": dict((k, v.dump()) for k, v in latency.items()),
+        "queries": dict((k, v.dump()) for k, v in queries.items()),
+        "query_time": dict(query_time),
+        "responses": [list(k) + [v] for k, v in responses.items()],
+        "slow_queries": slow_queries
+    }
+
+def snapshot():
+    with _lock:
+        return to_snapshot(_latency, _queries, _query_time, _responses, _slow_queries)
+
+def dump():
+    global _name, _dumped
+    folder = engine.config["METRICS_DIR"]
+    if not folder:
+        return
+    if _name is None:
+        _name = worker_name()
+    _dumped = time.time()
+    os.makedirs(folder, exist_ok=True)
+    write_file(os.path.join(folder, "{}.json".format(_name)), snapshot())
+
+def write_file(path, data):
+    temp = path + ".tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def is_retired(folder, name, now):
+    # Files named "<pid>-<id>.json", left by a worker that exited at least
+    # METRICS_RETIRE_AFTER seconds ago
+    try:
+        pid = int(name.split("-", 1)[0])
+        mtime = os.stat(os.path.join(folder, name)).st_mtime
+    except (ValueError, OSError):
+        return False
+    return now - mtime >= engine.config["METRICS_RETIRE_AFTER"] and not is_running(pid)
+
+def retire(folder):
+    # Adds the files of exited workers to retired.json and deletes them.
+    # The names folded in are kept until the files are gone, a scrape
+    # interrupted between the two steps doesn't count them twice
+    import fcntl
+
+    with open(os.path.join(folder, "retired.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = os.path.join(folder, "retired.json")
+        retired = read_file(path) or {"workers": [], "data": None}
+        names = set(os.listdir(folder))
+        done = [v for v in retired["workers"] if v in names]
+        now = time.time()
+        stale = [v for v in names if v.endswith(".json") and v != "retired.json" and
+            not (v in done) and is_retired(folder, v, now)]
+        if not stale and len(done) == len(retired["workers"]):
+            return
+
+        data = [retired["data"]] if retired["data"] else []
+        for name in stale:
+            v = read_file(os.path.join(folder, name))
+            if v is not None:
+                data.append(v)
+        write_file(path, {"workers": done + stale, "data": to_snapshot(*merge(data))})
+        for name in done + stale:
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+
+def load_all():
+    # Snapshots of every worker of the server, past ones in retired.json
+    folder = engine.config["METRICS_DIR"]
+    if not folder:
+        return [snapshot()]
+    dump()
+    retire(folder)
+    retired = read_file(os.path.join(folder, "retired.json")) or {"workers": [], "data": None}
+    data = [retired["data"]] if retired["data"] else []
+    for name in os.listdir(folder):
+        if not name.endswith(".json") or name == "retired.json" or name in retired["workers"]:
+            continue
+        v = read_file(os.path.join(folder, name))
+        if v is not None:
+            data.append(v)
+    return data
+
+def merge(data):
+    latency = {}
+    queries = {}
+    query_time = {}
+    responses = {}
+    slow_queries = 0
+    for v in data:
+        for target, buckets, key in [(latency, LATENCY_BUCKETS, "latency"), (queries, QUERY_BUCKETS, "queries")]:
+            for endpoint, (counts, total, count) in v[key].items():
+                histogram = Histogram(buckets, counts, total, count)
+                if endpoint in target:
+                    target[endpoint].merge(histogram)
+                else:
+                    target[endpoint] = histogram
+        for endpoint, seconds in v["query_time"].items():
+            query_time[endpoint] = query_time.get(endpoint, 0) + seconds
+        for endpoint, method, status, count in v["responses"]:
+            key = (endpoint, method, status)
+            responses[key] = responses.get(key, 0) + count
+        slow_queries += v["slow_queries"]
+    return latency, queries, query_time, responses, slow_queries
+
+@engine.before_request
+def start_request():
+    if not engine.config["METRICS"]:
+        return
+    g.metrics_start = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_time = 0
+
+@engine.after_request
+def keep_status(response):
+    if "metrics_start" in g:
+        g.metrics_status = response.status_code
+    return response
+
+@engine.teardown_request
+def record_request(exc):
+    # Runs for every request, the ones ending in an exception count as 500
+    if not ("metrics_start" in g):
+        return
+    elapsed = time.perf_counter() - g.metrics_start
+    endpoint = request.endpoint or "none"
+    status = g.get("metrics_status", 500)
+    with _lock:
+        if endpoint not in _latency:
+            _latency[endpoint] = Histogram(LATENCY_BUCKETS)
+            _queries[endpoint] = Histogram(QUERY_BUCKETS)
+            _query_time[endpoint] = 0
+        _latency[endpoint].observe(elapsed)
+        _queries[endpoint].observe(g.sql_queries)
+        _query_time[endpoint] += g.sql_time
+        key = (endpoint, request.method, status)
+        _responses[key] = _responses.get(key, 0) + 1
+
+    if engine.config["METRICS_DIR"] and time.time() - _dumped >= 1:
+        dump()
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    global _slow_queries
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    endpoint = None
+    if has_request_context() and "sql_queries" in g:
+        g.sql_queries += 1
+        g.sql_time += elapsed
+        endpoint = request.endpoint
+
+    if elapsed >= engine.config["SLOW_QUERY_THRESHOLD"]:
+        with _lock:
+            _slow_queries += 1
+        slow_log.warning("Slow query %.3fs [%s] %s", elapsed, endpoint, " ".join(statement.split())[:1000])
+
+if engine.config["METRICS"]:
+    event.listen(Engine, "before_cursor_execute", start_query)
+    event.listen(Engine, "after_cursor_execute", record_query)
+
+def render_metrics():
+    latency, queries, query_time, responses, slow_queries = merge(load_all())
+
+    lines = [
+        "# HELP http_request_duration_seconds Time spent answering requests",
+        "# TYPE http_request_duration_seconds histogram"
+    ]
+    for endpoint, histogram in sorted(latency.items()):
+        lines.extend(histogram.lines("http_request_duration_seconds", 'endpoint="{}"'.format(endpoint)))
+
+    lines.append("# HELP http_requests_total Responses sent")
+    lines.append("# TYPE http_requests_total counter")
+    for (endpoint, method, status), count in sorted(responses.items()):
+        lines.append('http_requests_total{{endpoint="{}",method="{}",status="{}"}} {}'.format(endpoint, method, status, count))
+
+    lines.append("# HELP sql_queries_per_request SQL statements run by a request")
+    lines.append("# TYPE sql_queries_per_request histogram")
+    for endpoint, histogram in sorted(queries.items()):
+        lines.extend(histogram.lines("sql_queries_per_request", 'endpoint="{}"'.format(endpoint)))
+
+    lines.append("# HELP sql_query_duration_seconds_total Time spent in SQL statements")
+    lines.append("# TYPE sql_query_duration_seconds_total counter")
+    for endpoint, seconds in sorted(query_time.items()):
+        lines.append('sql_query_duration_seconds_total{{endpoint="{}"}} {}'.format(endpoint, seconds))
+
+    lines.append("# HELP sql_slow_queries_total Statements slower than the threshold")
+    lines.append("# TYPE sql_slow_queries_total counter")
+    lines.append("sql_slow_queries_total {}".format(slow_queries))
+
+    return "\n".join(lines) + "\n"
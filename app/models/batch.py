@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import contextlib
+from collections import OrderedDict
+from app import db
+
+# Unit of work, model changes made inside "with batch():" share a single
+# commit and the callbacks they register run once, after it
+_local = threading.local()
+
+class Batch(object):
+    def __init__(self):
+        self.changes = OrderedDict()
+        self.seen = set()
+        self.callbacks = []
+
+    def changed(self, products, action):
+        # Products passed to the change hooks, one call per action
+        items = self.changes.setdefault(action, [])
+        for v in products:
+            if not ((action, id(v)) in self.seen):
+                self.seen.add((action, id(v)))
+                items.append(v)
+
+    def defer(self, fn, *args):
+        if not ((fn, args) in self.callbacks):
+            self.callbacks.append((fn, args))
+
+    def run(self):
+        from .product import notify_change
+        for action, products in self.changes.items():
+            notify_change(products, action)
+        for fn, args in self.callbacks:
+            fn(*args)
+
+def current_batch():
+    return getattr(_local, "batch", None)
+
+@contextlib.contextmanager
+def batch():
+    # A nested batch joins the outer one
+    outer = current_batch()
+    if outer is not None:
+        yield outer
+        return
+
+    current = _local.batch = Batch()
+    session = db.session()
+    try:
+        yield current
+        # Objects of the batch keep their values, the hooks read them
+        # without reloading every row
+        expire = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire
+    except:
+        session.rollback()
+        raise
+    finally:
+        _local.batch = None
+
+    current.run()
+
+def commit(fn=None, *args):
+    # Commits now, or at the end of the running batch, then calls fn
+    current = current_batch()
+    if current is not None:
+        if fn is not None:
+            current.defer(fn, *args)
+        return
+    db.session.commit()
+    if fn is not None:
+        fn(*args)
+
+def commit_products(products, action):
+    current = current_batch()
+    if current is not None:
+        current.changed(products, action)
+        return
+    from .product import notify_change
+    db.session.commit()
+    notify_change(products, action)
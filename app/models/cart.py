@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import time
+from app import db, engine
+
+class CartItem(db.Model):
+    __tablename__ = "cart_items"
+
+    token = db.Column(db.String(32), primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)
+
+    def __repr__(self):
+        return "<CartItem#{}:{} [{}] />".format(self.token, self.product_id, self.quantity)
+
+class MemoryCartStore(object):
+    # Carts of this process only, least recently used carts are dropped
+    def __init__(self, maxsize, ttl):
+        from app.cache import LRUCache
+        self.carts = LRUCache(maxsize, ttl)
+
+    def get(self, token):
+        return dict(self.carts.get(token, {}))
+
+    def add(self, token, id, quantity=1):
+        with self.carts.lock:
+            items = self.carts.get(token, {})
+            items[id] = items.get(id, 0) + quantity
+            self.carts.set(token, items)
+
+    def set(self, token, id, quantity):
+        with self.carts.lock:
+            items = self.carts.get(token, {})
+            items[id] = quantity
+            self.carts.set(token, items)
+
+    def remove(self, token, id):
+        with self.carts.lock:
+            items = self.carts.get(token)
+            if items is not None and id in items:
+                del items[id]
+
+    def replace(self, token, items):
+        self.carts.set(token, dict(items))
+
+    def clear(self, token):
+        self.carts.pop(token)
+
+# Single statement upserts of SQLite and PostgreSQL, two concurrent adds of
+# the same line can't both insert it
+UPSERT = """INSERT INTO cart_items (token, product_id, quantity, updated_at)
+    VALUES (:token, :id, :quantity, :now)
+    ON CONFLICT (token, product_id) DO UPDATE SET quantity = {}, updated_at = excluded.updated_at"""
+
+class DatabaseCartStore(object):
+    # One row per cart line in the application database, carts no line of
+    # which was written for CART_TTL seconds are deleted once every
+    # CART_EXPIRE_INTERVAL seconds
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.expired = time.time()
+
+    def get(self, token):
+        rows = db.session.query(CartItem.product_id, CartItem.quantity).filter(CartItem.token == token)
+        return dict((v.product_id, v.quantity) for v in rows)
+
+    def upsert(self, token, id, quantity, increment):
+        now = int(time.time())
+        if db.engine.dialect.name in ("sqlite", "postgresql"):
+            db.session.execute(UPSERT.format("cart_items.quantity + excluded.quantity" if increment else "excluded.quantity"),
+                {"token": token, "id": id, "quantity": quantity, "now": now})
+            db.session.commit()
+            return
+
+        from sqlalchemy.exc import IntegrityError
+        values = {CartItem.quantity: CartItem.quantity + quantity if increment else quantity, CartItem.updated_at: now}
+        for attempt in range(2):
+            updated = CartItem.query.filter(CartItem.token == token, CartItem.product_id == id).update(
+                values, synchronize_session=False)
+            if updated == 0:
+                db.session.add(CartItem(token=token, product_id=id, quantity=quantity, updated_at=now))
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Inserted by a concurrent request, updated on the retry
+                db.session.rollback()
+
+    def add(self, token, id, quantity=1):
+        self.upsert(token, id, quantity, True)
+        self.expire()
+
+    def set(self, token, id, quantity):
+        self.upsert(token, id, quantity, False)
+
+    def remove(self, token, id):
+        CartItem.query.filter(CartItem.token == token, CartItem.product_id == id).delete(synchronize_session=False)
+        db.session.commit()
+
+    def replace(self, token, items):
+        now = int(time.time())
+        CartItem.query.filter(CartItem.token == token).delete(synchronize_session=False)
+        if items:
+            db.session.bulk_insert_mappings(CartItem, [{
+                "token": token,
+                "product_id": id,
+                "quantity": quantity,
+                "updated_at": now
+            } for id, quantity in items.items()])
+        db.session.commit()
+
+    def clear(self, token):
+        self.replace(token, {})
+
+    def expire(self, force=False):
+        # A cart lives as long as its most recently written line
+        now = time.time()
+        if not force and now - self.expired < engine.config["CART_EXPIRE_INTERVAL"]:
+            return 0
+        self.expired = now
+        stale = db.session.query(CartItem.token).group_by(CartItem.token).having(
+            db.func.max(CartItem.updated_at) < int(now - self.ttl))
+        count = CartItem.query.filter(CartItem.token.in_(stale.subquery())).delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+class RedisCartStore(object):
+    # One hash per cart, works against redis or any server speaking its
+    # protocol (keydb, dragonfly, a local redis-server for development)
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CART_BACKEND 'redis' requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def key(self, token):
+        return "cart:{}".format(token)
+
+    def get(self, token):
+        items = self.client.hgetall(self.key(token))
+        return dict((int(k), int(v)) for k, v in items.items())
+
+    def add(self, token, id, quantity=1):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self.key(token), id, quantity)
+        pipe.expire(self.key(token), self.ttl)
+        pipe.execute()
+
+    def set(self, token, id, quantity):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key(token), id, quantity)
+        pipe.expire(self.key(token), self.ttl)
+        pipe.execute()
+
+    def remove(self, token, id):
+        self.client.hdel(self.key(token), id)
+
+    def replace(self, token, items):
+        pipe = self.client.pipeline()
+        pipe.delete(self.key(token))
+        if items:
+            pipe.hset(self.key(token), mapping=items)
+            pipe.expire(self.key(token), self.ttl)
+        pipe.execute()
+
+    def clear(self, token):
+        self.client.delete(self.key(token))
+
+_store = None
+
+def get_cart_store():
+    global _store
+    if _store is None:
+        backend = engine.config["CART_BACKEND"]
+        if backend == "memory":
+            _store = MemoryCartStore(engine.config["CART_CACHE_SIZE"], engine.config["CART_TTL"])
+        elif backend == "redis":
+            _store = RedisCartStore(engine.config["CART_REDIS_URL"], engine.config["CART_TTL"])
+        else:
+            _store = DatabaseCartStore(engine.config["CART_TTL"])
+    return _store
+
+def update_cart(token, changes):
+    # Applies {id: quantity} to the lines already in the cart in one pass,
+    # products are added through /addtocart only. Quantities are clamped to
+    # 1..CART_MAX_QUANTITY and 0 or less removes the line. Every id left is
+    # checked in one query, lines of unknown or deleted products are dropped
+    # and the cart is written once
+    from .pricing import get_products
+
+    store = get_cart_store()
+    cart_items = store.get(token)
+    for id, quantity in changes.items():
+        if not (id in cart_items):
+            continue
+        if quantity <= 0:
+            cart_items.pop(id, None)
+        else:
+            cart_items[id] = min(quantity, engine.config["CART_MAX_QUANTITY"])
+
+    known = get_products(list(cart_items), fresh=True) if cart_items else {}
+    cart_items = dict((id, quantity) for id, quantity in cart_items.items() if id in known)
+    store.replace(token, cart_items)
+
+    return cart_items
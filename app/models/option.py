@@ -13,13 +13,15 @@ class Option(db.Model):
         self.name = name
 
     def add(self):
+        from .batch import commit
         db.session.add(self)
-        db.session.commit()
+        commit()
         return self
 
     def remove(self):
+        from .batch import commit
         db.session.delete(self)
-        db.session.commit()
+        commit()
         return self
 
     def update(self, **kwargs):
@@ -30,7 +32,8 @@ class Option(db.Model):
                 fields = fields + 1
 
         if fields > 0:
-            db.session.commit()
+            from .batch import commit
+            commit()
 
         return self
 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from app import db
+from .product import Product
+
+class OutOfStock(Exception):
+    pass
+
+class Order(db.Model):
+    __tablename__ = "orders"
+
+    id = db.Column(db.Integer, primary_key=True)
+    fullname = db.Column(db.String(126), nullable=False)
+    email = db.Column(db.String(126), nullable=False, default='')
+    telephone = db.Column(db.String(32), nullable=False)
+    address = db.Column(db.String(255), nullable=False)
+    payment = db.Column(db.String(10), nullable=False, default='cash')
+    description = db.Column(db.Text, nullable=False, default='')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(10), nullable=False, default='new')
+    created = db.Column(db.Integer, index=True, nullable=False, default=0)
+
+    def __init__(self):
+        pass
+
+    def __repr__(self):
+        return "<Order#{} [{}] />".format(self.id, self.fullname)
+
+class OrderItem(db.Model):
+    __tablename__ = "order_items"
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), index=True, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    price = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+
+    def __repr__(self):
+        return "<OrderItem#{} [{} x {}] />".format(self.id, self.quantity, self.name)
+
+def reserve_stock(items):
+    # Conditional decrement, a line only matches while enough stock is left
+    # so concurrent checkouts can't oversell, NULL stock is not tracked
+    table = Product.__table__
+    stmt = table.update().where(db.and_(
+        table.c.id == db.bindparam("pid"),
+        db.or_(table.c.stock.is_(None), table.c.stock >= db.bindparam("qty"))
+    )).values(stock=table.c.stock - db.bindparam("qty"))
+    rows = [{"pid": v["id"], "qty": v["quantity"]} for v in items]
+
+    if db.session.bind.dialect.supports_sane_multi_rowcount:
+        return db.session.execute(stmt, rows).rowcount == len(rows)
+
+    for row in rows:
+        if db.session.execute(stmt, row).rowcount != 1:
+            return False
+    return True
+
+def place_order(cart, fields):
+    # One transaction for the order, its lines and the stock reservation
+    import time
+    try:
+        order = Order()
+        for key, value in fields.items():
+            setattr(order, key, value)
+        order.total = cart["total"]
+        order.created = int(time.time())
+        db.session.add(order)
+        db.session.flush()
+
+        if not reserve_stock(cart["items"]):
+            raise OutOfStock()
+
+        db.session.execute(OrderItem.__table__.insert(), [{
+            "order_id": order.id,
+            "product_id": v["id"],
+            "name": v["name"],
+            "price": v["discounted"],
+            "quantity": v["quantity"]
+        } for v in cart["items"]])
+
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return order
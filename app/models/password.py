@@ -1,10 +1,92 @@
 # -*- coding: utf-8 -*-
 
 import bcrypt
+import threading
+
+class PasswordBusy(Exception):
+    pass
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+def run_hashing(fn, *args):
+    # bcrypt runs on a process pool so logins can't starve request threads,
+    # at most BCRYPT_WORKERS + BCRYPT_QUEUE_SIZE jobs wait, the rest fail fast
+    global _pool, _slots
+    from app import engine
+    import concurrent.futures
+    from concurrent.futures.process import BrokenProcessPool
+    workers = engine.config["BCRYPT_WORKERS"]
+    if workers <= 0:
+        return fn(*args)
+
+    with _lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(workers)
+            _slots = threading.BoundedSemaphore(workers + engine.config["BCRYPT_QUEUE_SIZE"])
+        pool = _pool
+        slots = _slots
+
+    if not slots.acquire(blocking=False):
+        raise PasswordBusy()
+    try:
+        future = pool.submit(fn, *args)
+    except (BrokenProcessPool, RuntimeError):
+        slots.release()
+        drop_pool(pool)
+        raise PasswordBusy()
+
+    # The slot is given back when the job ends, a job still running after
+    # the timeout keeps it
+    future.add_done_callback(lambda v: slots.release())
+    try:
+        return future.result(timeout=engine.config["BCRYPT_TIMEOUT"])
+    except concurrent.futures.TimeoutError:
+        raise PasswordBusy()
+    except BrokenProcessPool:
+        drop_pool(pool)
+        raise PasswordBusy()
+
+def drop_pool(pool):
+    # A worker died, the next login starts a new pool
+    global _pool, _slots
+    with _lock:
+        if _pool is pool:
+            _pool = None
+            _slots = None
+    pool.shutdown(wait=False)
+
+def shutdown_hashing():
+    global _pool, _slots
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+        _slots = None
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _checkpw(password, stored_password):
+    return bcrypt.checkpw(password, stored_password)
 
 def hash_password(password):
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode(), salt)
+    from app import engine
+    return run_hashing(_hashpw, password.encode(), engine.config["BCRYPT_ROUNDS"])
 
 def verify_password(stored_password, provided_password):
-    return bcrypt.checkpw(provided_password.encode(), stored_password)
+    if isinstance(stored_password, str):
+        stored_password = stored_password.encode()
+    return run_hashing(_checkpw, provided_password.encode(), stored_password)
+
+def needs_rehash(stored_password):
+    # "$2b$12$..." carries its cost factor in the prefix
+    from app import engine
+    if isinstance(stored_password, bytes):
+        stored_password = stored_password.decode()
+    try:
+        rounds = int(stored_password.split("$")[2])
+    except (IndexError, ValueError):
+        return True
+    return rounds != engine.config["BCRYPT_ROUNDS"]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from app import engine
+from app.cache import LRUCache
+from .product import Product, on_change
+from .. import versions
+
+# Price data of recently used products, shared by the cart and checkout
+_snapshots = LRUCache(engine.config["PRODUCT_CACHE_SIZE"], engine.config["PRODUCT_CACHE_TTL"])
+
+def format_price(value):
+    return "{:,}".format(int(value or 0))
+
+def sale_price(product):
+    # Rows without a sale price sell at the regular price, never for 0
+    return product.discounted_price or product.regular_price or 0
+
+def snapshot(product):
+    # Display fields are computed once here, listings and the cart only
+    # read them
+    price = product.regular_price or 0
+    discounted = sale_price(product)
+    on_sale = 0 < discounted < price
+    return {
+        "id": product.id,
+        "name": product.name,
+        "slug": product.slug,
+        "image": product.image,
+        "price": price,
+        "discounted": discounted,
+        "price_text": format_price(price),
+        "discounted_text": format_price(discounted),
+        "on_sale": on_sale,
+        "discount_percent": int(round((price - discounted) * 100.0 / price)) if on_sale else 0
+    }
+
+def display_prices(product):
+    # Snapshot of a loaded product, rebuilt when its prices no longer match
+    # (a write made by another worker)
+    v = _snapshots.get(product.id)
+    if v is None or v["price"] != (product.regular_price or 0) or v["discounted"] != sale_price(product):
+        v = _snapshots.set(product.id, snapshot(product))
+    return v
+
+def get_products(ids, fresh=False):
+    products = {}
+    missing = []
+    for id in ids:
+        v = None if fresh else _snapshots.get(id)
+        if v is None:
+            missing.append(id)
+        else:
+            products[id] = v
+
+    if len(missing) > 0:
+        for v in Product.query.filter(Product.id.in_(missing)).all():
+            products[v.id] = _snapshots.set(v.id, snapshot(v))
+
+    return products
+
+@versions.watch("catalog")
+def forget_products():
+    # A product write in another worker
+    _snapshots.clear()
+
+@on_change
+def invalidate_products(products, action):
+    if action == "import":
+        _snapshots.clear()
+    for v in products:
+        _snapshots.pop(v.id)
+
+def price_cart(cart_items, fresh=False):
+    cart = {
+        "items": [],
+        "count": 0,
+        "total": 0,
+        "regular_total": 0,
+        "discount": 0,
+        "total_text": "0",
+        "regular_total_text": "0",
+        "discount_text": "0"
+    }
+    if not cart_items:
+        return cart
+
+    products = get_products(list(cart_items), fresh)
+    for id, quantity in cart_items.items():
+        v = products.get(id)
+        if v is None:
+            continue
+        item = dict(v)
+        item["quantity"] = quantity
+        item["subtotal"] = quantity * v["discounted"]
+        item["discount"] = quantity * (v["price"] - v["discounted"])
+        cart["items"].append(item)
+        cart["count"] += quantity
+        cart["total"] += item["subtotal"]
+        cart["regular_total"] += quantity * v["price"]
+        cart["discount"] += item["discount"]
+
+    for item in cart["items"]:
+        item["subtotal_text"] = format_price(item["subtotal"])
+    for key in ["total", "regular_total", "discount"]:
+        cart[key + "_text"] = format_price(cart[key])
+
+    return cart
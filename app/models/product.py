@@ -1,31 +1,81 @@
 # -*- coding: utf-8 -*-
 
-from app import db
+from app import engine, db
+from app.cache import LRUCache
+from .. import versions
+
+# Callbacks run after products are written, each one receives the list of
+# changed products and the action ("save", "update" or "remove"), bulk
+# loads send "import" with an empty list as any product may have changed
+_listeners = []
+
+def on_change(fn):
+    _listeners.append(fn)
+    return fn
+
+def notify_change(products, action):
+    for fn in _listeners:
+        fn(products, action)
 
 class Product(db.Model):
     __tablename__ = "products"
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    slug = db.Column(db.String(100), nullable=False)
+    slug = db.Column(db.String(100), index=True, unique=True, nullable=False)
     description = db.Column(db.String(100), nullable=False)
     image = db.Column(db.String(100), nullable=False)
     regular_price = db.Column(db.Integer)
     discounted_price = db.Column(db.Integer)
+    stock = db.Column(db.Integer, nullable=True)
 
     def __init__(self):
         pass
 
     def save(self):
+        from .batch import commit_products
         db.session.add(self)
-        db.session.commit()
+        commit_products([self], "save")
         return self
 
     def remove(self):
+        from .batch import commit_products
         db.session.delete(self)
-        db.session.commit()
+        commit_products([self], "remove")
         return self
 
+    @classmethod
+    def get_by_slug(cls, slug):
+        # Primary key fetch through the slug map, an entry left stale by a
+        # write in another worker is noticed and looked up again
+        id = _slugs.get(slug)
+        if id is not None:
+            product = cls.query.get(id)
+            if product is not None and product.slug == slug:
+                return product
+            _slugs.pop(slug)
+
+        product = cls.query.filter(cls.slug == slug).first()
+        if product is not None:
+            _slugs.set(slug, product.id)
+        return product
+
+    @classmethod
+    def page(cls, after=0, limit=24):
+        # Keyset pagination, walks the primary key index from the cursor
+        # instead of scanning and skipping with OFFSET
+        query = cls.query
+        if after > 0:
+            query = query.filter(cls.id > after)
+        rows = query.order_by(cls.id).limit(limit + 1).all()
+
+        next_after = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_after = rows[-1].id
+
+        return rows, next_after
+
     def update(self, **kwargs):
         fields = 0
         for key, value in kwargs.items():
@@ -34,9 +84,25 @@ class Product(db.Model):
                 fields = fields + 1
 
         if fields > 0:
-            db.session.commit()
+            from .batch import commit_products
+            commit_products([self], "update")
 
         return self
 
     def __repr__(self):
         return "<Product#{} [{}] />".format(self.id, self.name)
+
+# Slug to id of recently viewed products
+_slugs = LRUCache(engine.config["PRODUCT_CACHE_SIZE"], engine.config["PRODUCT_CACHE_TTL"])
+
+@versions.watch("catalog")
+def forget_slugs():
+    _slugs.clear()
+
+@on_change
+def invalidate_slugs(products, action):
+    if action == "import":
+        _slugs.clear()
+    ids = set(v.id for v in products)
+    if ids:
+        _slugs.prune(lambda slug, id: id in ids)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+import re
+from app import db, engine
+from .product import Product, on_change
+
+class RelatedProduct(db.Model):
+    __tablename__ = "related_products"
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, index=True, nullable=False)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<RelatedProduct#{}:{} [{}] />".format(self.product_id, self.rank, self.related_id)
+
+class ProductToken(db.Model):
+    __tablename__ = "product_tokens"
+
+    # Inverted index of the name and description words, the products
+    # sharing a word with a changed one are the only ones it can relate to
+    token = db.Column(db.String(64), primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False, index=True)
+
+    def __repr__(self):
+        return "<ProductToken {} [{}] />".format(self.token, self.product_id)
+
+def tokenize(text):
+    from unidecode import unidecode
+    return set(v[:64] for v in re.findall(r"[a-z0-9]+", unidecode(text or "").lower()))
+
+def product_tokens(product):
+    return tokenize(product.name) | tokenize(product.description)
+
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    if common == 0:
+        return 0.0
+    return common / (len(a) + len(b) - common)
+
+def chunks(ids, size=500):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def load_catalog():
+    rows = db.session.query(Product.id, Product.name, Product.description).all()
+    return dict((v.id, product_tokens(v)) for v in rows)
+
+def load_tokens(ids):
+    tokens = dict((v, set()) for v in ids)
+    for part in chunks(ids):
+        for token, product_id in db.session.query(ProductToken.token, ProductToken.product_id).filter(
+                ProductToken.product_id.in_(part)):
+            tokens[product_id].add(token)
+    return tokens
+
+def pick_candidates(id, tokens, frequency, postings, limit):
+    # Rarest words first, they say the most about a product, stops once
+    # limit products were found
+    found = set()
+    for token in sorted(tokens, key=lambda v: (frequency(v), v)):
+        for other in postings(token, limit - len(found) + 1):
+            if other != id:
+                found.add(other)
+                if len(found) >= limit:
+                    return found
+    return found
+
+def find_candidates(id, tokens, limit):
+    counts = {}
+    for part in chunks(tokens):
+        counts.update(db.session.query(ProductToken.token, db.func.count()).filter(
+            ProductToken.token.in_(part)).group_by(ProductToken.token))
+
+    def postings(token, count):
+        return [v[0] for v in db.session.query(ProductToken.product_id).filter(
+            ProductToken.token == token).order_by(ProductToken.product_id).limit(count)]
+
+    return pick_candidates(id, tokens, lambda v: counts.get(v, 0), postings, limit)
+
+def load_lists(ids):
+    lists = {}
+    for part in chunks(ids):
+        for v in RelatedProduct.query.filter(RelatedProduct.product_id.in_(part)).order_by(
+                RelatedProduct.product_id, RelatedProduct.rank):
+            lists.setdefault(v.product_id, []).append((v.score, v.related_id))
+    return lists
+
+def write_tokens(catalog, ids):
+    if not ids:
+        return
+    for part in chunks(ids):
+        ProductToken.query.filter(ProductToken.product_id.in_(part)).delete(synchronize_session=False)
+    rows = []
+    for id in ids:
+        for token in catalog.get(id, ()):
+            rows.append({
+                "token": token,
+                "product_id": id
+            })
+    if rows:
+        db.session.bulk_insert_mappings(ProductToken, rows)
+
+def neighbours(id, tokens, catalog, limit):
+    scores = []
+    for other, other_tokens in catalog.items():
+        if other == id:
+            continue
+        score = similarity(tokens, other_tokens)
+        if score > 0:
+            scores.append((score, other))
+    scores.sort(key=lambda x: (-x[0], x[1]))
+    return scores[:limit]
+
+def write_lists(lists, ids):
+    if not ids:
+        return
+    for part in chunks(ids):
+        RelatedProduct.query.filter(RelatedProduct.product_id.in_(part)).delete(synchronize_session=False)
+    rows = []
+    for id in ids:
+        for rank, (score, related_id) in enumerate(lists.get(id, [])):
+            rows.append({
+                "product_id": id,
+                "rank": rank,
+                "related_id": related_id,
+                "score": score
+            })
+    if rows:
+        db.session.bulk_insert_mappings(RelatedProduct, rows)
+
+def index_tokens():
+    catalog = load_catalog()
+    ProductToken.query.delete(synchronize_session=False)
+    write_tokens(catalog, catalog.keys())
+    db.session.commit()
+    return len(catalog)
+
+def rebuild_related():
+    # Every product is compared with the candidates of its rarest words
+    # only, never with the whole catalog
+    limit = engine.config["RELATED_PRODUCTS"]
+    size = engine.config["RELATED_CANDIDATES"]
+    catalog = load_catalog()
+
+    index = {}
+    for id, tokens in catalog.items():
+        for token in tokens:
+            index.setdefault(token, []).append(id)
+
+    lists = {}
+    for id, tokens in catalog.items():
+        candidates = pick_candidates(id, tokens, lambda v: len(index[v]), lambda v, count: index[v], size)
+        lists[id] = neighbours(id, tokens, dict((v, catalog[v]) for v in candidates), limit)
+
+    ProductToken.query.delete(synchronize_session=False)
+    write_tokens(catalog, catalog.keys())
+    RelatedProduct.query.delete(synchronize_session=False)
+    write_lists(lists, lists.keys())
+    db.session.commit()
+
+    return len(lists)
+
+@db.event.listens_for(Product.name, "set")
+@db.event.listens_for(Product.description, "set")
+def mark_text_changed(target, value, oldvalue, initiator):
+    # Price and stock writes leave the related lists as they are
+    if value != oldvalue:
+        target._text_changed = True
+
+@on_change
+def refresh_related(products, action):
+    if action == "remove":
+        # Lists that pointed at the removed products just get shorter, the
+        # next full rebuild fills them up again
+        ids = [v.id for v in products]
+        if not ids:
+            return
+        RelatedProduct.query.filter(db.or_(
+            RelatedProduct.product_id.in_(ids),
+            RelatedProduct.related_id.in_(ids)
+        )).delete(synchronize_session=False)
+        ProductToken.query.filter(ProductToken.product_id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return
+
+    changed = [v for v in products if getattr(v, "_text_changed", False)]
+    if not changed:
+        return
+    for v in changed:
+        v._text_changed = False
+
+    limit = engine.config["RELATED_PRODUCTS"]
+    size = engine.config["RELATED_CANDIDATES"]
+    tokens = dict((v.id, product_tokens(v)) for v in changed)
+    write_tokens(tokens, tokens.keys())
+
+    # Products sharing a rare word with the changed ones, and the ones
+    # whose list holds a changed product, are the only lists that move
+    candidates = set()
+    for id, words in tokens.items():
+        candidates.update(find_candidates(id, words, size))
+    for part in chunks(tokens):
+        candidates.update(v[0] for v in db.session.query(RelatedProduct.product_id).filter(
+            RelatedProduct.related_id.in_(part)))
+    catalog = load_tokens(candidates | set(tokens))
+    lists = load_lists(catalog.keys())
+    dirty = set()
+
+    for id in tokens:
+        lists[id] = neighbours(id, tokens[id], catalog, limit)
+        dirty.add(id)
+
+        # Merge the changed product into the lists of the candidates
+        for other, other_tokens in catalog.items():
+            if other == id:
+                continue
+            old = lists.get(other, [])
+            new = [v for v in old if v[1] != id]
+            score = similarity(tokens[id], other_tokens)
+            if score > 0:
+                new.append((score, id))
+            new.sort(key=lambda x: (-x[0], x[1]))
+            new = new[:limit]
+            if new != old:
+                lists[other] = new
+                dirty.add(other)
+
+    write_lists(lists, dirty)
+    db.session.commit()
+
+def get_related(product):
+    limit = engine.config["RELATED_PRODUCTS"]
+    ids = [v.related_id for v in db.session.query(RelatedProduct.related_id)
+        .filter(RelatedProduct.product_id == product.id)
+        .order_by(RelatedProduct.rank)
+        .limit(limit)]
+
+    if len(ids) == 0:
+        # Not indexed yet, fall back to the next products by id which is
+        # still a primary key range read
+        return Product.query.filter(Product.id != product.id).order_by(Product.id).limit(limit).all()
+
+    rows = dict((v.id, v) for v in Product.query.filter(Product.id.in_(ids)).all())
+
+    return [rows[id] for id in ids if id in rows]
@@ -1,6 +1,42 @@
 # -*- coding: utf-8 -*-
 
-from app import db
+from app import db, engine
+from app.cache import LRUCache
+from .. import versions
+
+# Verified auth cookies mapped to a snapshot of their user
+_sessions = LRUCache(engine.config["AUTH_CACHE_SIZE"], engine.config["AUTH_CACHE_TTL"])
+
+class UserSnapshot(object):
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.nickname = user.nickname
+        self.email = user.email
+        self.blocked = user.blocked
+        self.role = user.role
+
+    def is_blocked(self):
+        return self.blocked == "y"
+
+    def __repr__(self):
+        return "<UserSnapshot#{} [{}] />".format(self.id, self.nickname)
+
+def get_session(cookie):
+    return _sessions.get(cookie)
+
+def set_session(cookie, user):
+    return _sessions.set(cookie, UserSnapshot(user))
+
+def forget_sessions(id):
+    # The other workers drop all their sessions once they see the
+    # "users" version move
+    _sessions.prune(lambda k, v: v.id == id)
+    versions.bump("users")
+
+@versions.watch("users")
+def forget_all_sessions():
+    _sessions.clear()
 
 class User(db.Model):
     __tablename__ = "users"
@@ -17,13 +53,15 @@ class User(db.Model):
         self.username = username
 
     def save(self):
+        from .batch import commit
         db.session.add(self)
-        db.session.commit()
+        commit()
         return self
 
     def remove(self):
+        from .batch import commit
         db.session.delete(self)
-        db.session.commit()
+        commit(forget_sessions, self.id)
         return self
 
     def update(self, **kwargs):
@@ -34,7 +72,8 @@ class User(db.Model):
                 fields = fields + 1
 
         if fields > 0:
-            db.session.commit()
+            from .batch import commit
+            commit(forget_sessions, self.id)
 
         return self
 
@@ -43,8 +82,15 @@ class User(db.Model):
         self.password = hash_password(password)
 
     def check_password(self, password):
-        from .password import verify_password
-        return verify_password(self.password, password)
+        from .password import verify_password, needs_rehash, hash_password
+        if not verify_password(self.password, password):
+            return False
+
+        # Upgrade the stored hash once BCRYPT_ROUNDS changed
+        if needs_rehash(self.password):
+            self.update(password=hash_password(password))
+
+        return True
 
     def is_blocked(self):
         return self.blocked == "y"
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from app import engine, db, SITE_URL
+from .models.option import Option
+from . import versions
+
+# Site settings from the options table, held by every worker. A write
+# bumps the shared "options" version and every worker reloads them when
+# it sees the bump. The cookie names and folders stay module constants,
+# renaming a cookie logs every admin out and the folders are read by the
+# thumbnail processes
+DEFAULTS = {
+    "site_name": "",
+    "site_description": "",
+    "site_url": SITE_URL
+}
+
+_lock = threading.Lock()
+_options = dict(DEFAULTS)
+_loaded = False
+
+def is_setting(name):
+    # The shared counters of versions.py live in the same table and are
+    # never shown, written back or deleted through the settings
+    return not name.startswith(versions.PREFIX)
+
+def load_options():
+    global _options, _loaded
+    options = dict(DEFAULTS)
+    for name, value in db.session.query(Option.name, Option.value):
+        if is_setting(name):
+            options[name] = value
+    with _lock:
+        _options = options
+        _loaded = True
+    return options
+
+@versions.watch("options")
+def reload_options():
+    load_options()
+    # Cached pages embed the options
+    from .pagecache import forget_pages
+    forget_pages()
+
+def get_options():
+    return _options
+
+def get_option(name, default=None):
+    return _options.get(name, default)
+
+def set_options(values):
+    # The options and the version are written in one commit
+    for name, value in values.items():
+        if not is_setting(name):
+            continue
+        row = Option.query.get(name)
+        if row is None:
+            row = Option(name)
+            db.session.add(row)
+        row.value = value
+    versions.bump("options")
+    reload_options()
+
+def delete_option(name):
+    if not is_setting(name):
+        return
+    Option.query.filter(Option.name == name).delete(synchronize_session=False)
+    versions.bump("options")
+    reload_options()
+
+def reset():
+    global _options, _loaded
+    with _lock:
+        _options = dict(DEFAULTS)
+        _loaded = False
+
+@engine.before_request
+def refresh_options():
+    # Later changes arrive through the "options" version
+    if _loaded:
+        return
+    try:
+        load_options()
+    except:
+        # Before the options table exists the defaults are used
+        db.session.rollback()
+
+@engine.context_processor
+def inject_options():
+    return {"options": _options, "site_url": _options.get("site_url", SITE_URL)}
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+from app import engine
+from .cache import LRUCache
+from .models.product import on_change
+from . import versions
+
+# Rendered storefront pages, keys embed the catalog version so a product
+# write makes every older page unreachable at once. The version is shared
+# with the other workers through the "catalog" counter
+_pages = LRUCache(engine.config["PAGE_CACHE_SIZE"], engine.config["PAGE_CACHE_TTL"])
+_version = 0
+_writes = 0
+
+class Page(object):
+    # The HTML of a page and its compressed bodies, each encoding is
+    # compressed once, on the first request accepting it
+    def __init__(self, html):
+        self.html = html
+        self.encoded = {}
+
+    def encode(self, encoding):
+        from .compression import compress
+        body = self.encoded.get(encoding)
+        if body is None:
+            body = self.encoded[encoding] = compress(self.html.encode("utf-8"), encoding)
+        return body
+
+def stamp_path():
+    folder = engine.config["PAGE_CACHE_DIR"]
+    if not folder:
+        return None
+    return os.path.join(folder, "catalog.version")
+
+def catalog_version():
+    # With the disk tier the version is the mtime of a stamp file, so every
+    # worker sharing the folder agrees on it
+    path = stamp_path()
+    if path is None:
+        return _version
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+def bump_version():
+    global _version
+    _version = _version + 1
+    path = stamp_path()
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a"):
+            os.utime(path, None)
+
+def disk_path(key):
+    folder = engine.config["PAGE_CACHE_DIR"]
+    if not folder:
+        return None
+    return os.path.join(folder, hashlib.sha1(repr(key).encode()).hexdigest() + ".html")
+
+def get_page(key):
+    page = _pages.get(key)
+    if page is not None:
+        return page
+
+    path = disk_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+    except IOError:
+        return None
+
+    return _pages.set(key, Page(html))
+
+def set_page(key, html):
+    global _writes
+    page = _pages.set(key, Page(html))
+
+    path = disk_path(key)
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(temp, path)
+
+        _writes = _writes + 1
+        if _writes % 64 == 0:
+            trim_disk()
+
+    return page
+
+def page_response(page):
+    from flask import request, make_response
+    from .compression import accepted_encodings
+
+    resp = None
+    if len(page.html) >= engine.config["COMPRESS_MIN_SIZE"]:
+        for encoding in accepted_encodings(request):
+            resp = make_response(page.encode(encoding))
+            resp.headers["Content-Encoding"] = encoding
+            break
+    if resp is None:
+        resp = make_response(page.html)
+    resp.vary.add("Accept-Encoding")
+
+    return resp
+
+def cached_page(key, render):
+    if not engine.config["PAGE_CACHE"]:
+        return render()
+
+    key = key + (catalog_version(),)
+    page = get_page(key)
+    if page is None:
+        page = set_page(key, render())
+
+    return page_response(page)
+
+def disk_pages(folder):
+    # (mtime, path) of the page files, another worker may be deleting them
+    pages = []
+    for name in os.listdir(folder):
+        if not name.endswith(".html"):
+            continue
+        path = os.path.join(folder, name)
+        try:
+            pages.append((os.stat(path).st_mtime_ns, path))
+        except FileNotFoundError:
+            pass
+    return pages
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def purge_disk(version):
+    # Pages of older versions are unreachable, drop their files
+    folder = engine.config["PAGE_CACHE_DIR"]
+    if not folder or not os.path.isdir(folder):
+        return
+    for mtime, path in disk_pages(folder):
+        if mtime < version:
+            remove_file(path)
+
+def trim_disk():
+    # Every distinct cursor is a page of its own, the oldest files go once
+    # the folder holds more than PAGE_CACHE_DISK_SIZE of them
+    folder = engine.config["PAGE_CACHE_DIR"]
+    if not folder or not os.path.isdir(folder):
+        return
+    pages = disk_pages(folder)
+    extra = len(pages) - engine.config["PAGE_CACHE_DISK_SIZE"]
+    if extra <= 0:
+        return
+    pages.sort()
+    for mtime, path in pages[:extra]:
+        remove_file(path)
+
+@versions.watch("catalog")
+def forget_pages():
+    bump_version()
+    _pages.clear()
+    if stamp_path() is not None:
+        purge_disk(catalog_version())
+
+@on_change
+def invalidate_pages(products, action):
+    forget_pages()
+    versions.bump("catalog")
@@ -4,6 +4,116 @@ from app import db
 from .initializedb import init_database
 
 def initdb():
-    init_database(db)
+    init_database(db, log=print)
 
     print("Initialized default DB")
+
+def migrate(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="run migrate", description="Apply pending schema migrations")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument("--status", action="store_true", help="list pending migrations only")
+    args = parser.parse_args(args)
+
+    from .migrations import migrate as apply_migrations, pending_migrations
+    if args.status:
+        for version, description, fn in pending_migrations(db):
+            print("Pending {} {}".format(version, description))
+        return
+
+    done = apply_migrations(db, args.target, log=print)
+
+    print("Applied {} migrations".format(len(done)))
+
+def build():
+    from app import engine
+    from .build import build as build_assets
+    templates, compiled, compressed = build_assets(engine, log=print)
+
+    print("Minified {} templates, compiled {}, compressed {} static files".format(templates, compiled, compressed))
+
+def related():
+    from ..models.related import rebuild_related
+    count = rebuild_related()
+
+    print("Rebuilt related products for {} products".format(count))
+
+def thumbnails():
+    from ..models.product import Product
+    from ..thumbnails import schedule_thumbnails
+
+    images = set(v.image for v in Product.query.with_entities(Product.image).distinct() if v.image)
+    futures = schedule_thumbnails(images)
+    failed = 0
+    for future in futures:
+        try:
+            if future.result() is None:
+                failed = failed + 1
+        except Exception:
+            failed = failed + 1
+
+    print("Built {} thumbnails for {} images, {} failed".format(len(futures) - failed, len(images), failed))
+
+def manifest():
+    from ..manifest import build_manifest
+    count = build_manifest()
+
+    print("Hashed {} images into the asset manifest".format(count))
+
+def import_products(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="run import", description="Upsert products keyed on slug from CSV or JSON lines")
+    parser.add_argument("file", help="path, .gz compressed or - for stdin")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--commit-every", type=int, default=50, help="batches per transaction")
+    parser.add_argument("--keep-indexes", action="store_true", help="don't drop secondary indexes while loading")
+    args = parser.parse_args(args)
+
+    from .catalog import import_catalog
+    inserted, updated, skipped = import_catalog(db, args.file, args.format, args.batch, args.commit_every, not args.keep_indexes)
+
+    print("Imported {} new, {} updated, {} skipped products".format(inserted, updated, skipped))
+    print("Run ./run related and ./run thumbnails to refresh derived data")
+
+def export_products(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="run export", description="Write every product as CSV or JSON lines")
+    parser.add_argument("file", help="path, .gz compressed or - for stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args(args)
+
+    from .catalog import export_catalog
+    count = export_catalog(db, args.file, args.format, args.batch)
+
+    if args.file != "-":
+        print("Exported {} products".format(count))
+
+def bench(args):
+    import argparse
+    parser = argparse.ArgumentParser(prog="run bench", description="Benchmark the storefront, cart and login flows on a synthetic catalog")
+    parser.add_argument("--products", type=int, default=1000, help="size of the seeded catalog")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--login-requests", type=int, default=20, help="logins, each one hashes a password")
+    parser.add_argument("--mode", choices=["client", "server", "both"], default="client")
+    parser.add_argument("--workers", type=int, default=2, help="server workers")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel sessions against the server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args(args)
+
+    from app import engine
+    from .bench import run_bench
+    report = run_bench(engine, db, args.products, args.requests, args.login_requests, args.mode, args.workers, args.concurrency, args.seed, log=print)
+
+    for mode, routes in report["results"].items():
+        print("{:<8} {:<10} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}".format(mode, "route", "requests", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries"))
+        for name, v in routes.items():
+            print("{:<8} {:<10} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}".format("", name, v["requests"], v["p50_ms"], v["p95_ms"], v["p99_ms"], v["throughput_rps"], "-" if v["queries_per_request"] is None else v["queries_per_request"]))
+
+    import json
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print("Saved {}".format(args.output))
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import random
+import socket
+import tempfile
+import platform
+import subprocess
+import threading
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = [
+    "iphone", "samsung", "galaxy", "xiaomi", "oppo", "nokia", "pixel", "pro",
+    "max", "mini", "ultra", "lite", "plus", "note", "edge", "fold", "black",
+    "white", "blue", "gold", "silver", "green", "red", "case", "charger",
+    "cable", "glass", "watch", "buds", "tablet", "laptop", "speaker"
+]
+
+# Settings of the benchmark database, the login throttle would otherwise
+# turn every login after the burst into a redirect
+def bench_settings(path):
+    return {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///{}".format(path),
+        "LOGIN_BURST": 1000000000,
+        "PAGE_CACHE_DIR": None,
+        "SLOW_QUERY_LOG": None
+    }
+
+def seed_catalog(db, size, rng, batch_size=1000):
+    from ..models.product import Product, notify_change
+
+    batch = []
+    for number in range(1, size + 1):
+        name = " ".join(rng.choice(WORDS) for v in range(rng.randint(2, 4))).title()
+        price = rng.randint(10, 3000) * 10000
+        product = Product()
+        product.name = "{} {}".format(name, number)[:100]
+        product.slug = "{}-{}".format(name.lower().replace(" ", "-"), number)[:100]
+        product.description = " ".join(rng.choice(WORDS) for v in range(12))
+        product.image = "bench.jpg"
+        product.regular_price = price
+        product.discounted_price = price - rng.choice([0, 0, price // 10])
+        batch.append(product)
+        if len(batch) >= batch_size:
+            db.session.add_all(batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.add_all(batch)
+        db.session.commit()
+    notify_change([], "import")
+
+    return [(v.id, v.slug) for v in Product.query.with_entities(Product.id, Product.slug)]
+
+def percentile(values, p):
+    # Nearest rank
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(round(p / 100.0 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+def summarize(samples, queries, elapsed):
+    latencies = [v[0] for v in samples]
+    # None of the flows expects a 4xx, they count as errors like 5xx and
+    # failed connections
+    errors = len([v for v in samples if v[1] >= 400 or v[1] == 0])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None
+    }
+
+# Every flow is a list of (name, measured, method, path, form), only the
+# measured steps are timed, the others put the session in the right state
+def build_flows(products, rng):
+    def product():
+        id, slug = rng.choice(products)
+        return [("product", True, "GET", "/product/{}/".format(slug), None)]
+
+    def home():
+        return [("home", True, "GET", "/", None)]
+
+    def addtocart():
+        # A few distinct lines, the cart stays the size of a real one
+        id, slug = rng.choice(products[:10])
+        return [("addtocart", True, "GET", "/addtocart?id={}".format(id), None)]
+
+    def cart():
+        return [("cart", True, "GET", "/cart", None)]
+
+    def checkout():
+        return [("checkout", True, "GET", "/checkout", None)]
+
+    def order():
+        id, slug = rng.choice(products)
+        return [
+            ("", False, "GET", "/addtocart?id={}".format(id), None),
+            ("order", True, "POST", "/checkout", {
+                "fullname": "Bench", "telephone": "0900000000", "address": "Bench street",
+                "email": "bench@ecommerce.io", "payment": "cash", "description": ""
+            })
+        ]
+
+    def login():
+        return [("login", True, "POST", "/admin/login", {"login": "admin", "password": "123456"})]
+
+    return [
+        ("home", home), ("product", product), ("addtocart", addtocart),
+        ("cart", cart), ("checkout", checkout), ("order", order), ("login", login)
+    ]
+
+def run_client(engine, db, flows, requests, login_requests):
+    # Single threaded through the Flask test client, SQL statements are
+    # counted per request
+    from sqlalchemy import event
+
+    counter = [0]
+    def count_query(*args):
+        counter[0] += 1
+    event.listen(db.engine, "after_cursor_execute", count_query)
+
+    results = {}
+    client = engine.test_client()
+    try:
+        for name, flow in flows:
+            total = login_requests if name == "login" else requests
+            samples = []
+            queries = []
+            started = time.perf_counter()
+            for number in range(total):
+                if name == "login":
+                    client = engine.test_client()
+                for step, measured, method, path, form in flow():
+                    counter[0] = 0
+                    start = time.perf_counter()
+                    if method == "POST":
+                        resp = client.post(path, data=form)
+                    else:
+                        resp = client.get(path)
+                    if measured:
+                        samples.append((time.perf_counter() - start, resp.status_code))
+                        queries.append(counter[0])
+            results[name] = summarize(samples, queries, time.perf_counter() - started)
+    finally:
+        event.remove(db.engine, "after_cursor_execute", count_query)
+
+    return results
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def wait_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def parse_queries(text):
+    # [sum, count] of sql_queries_per_request by endpoint
+    import re
+    values = {}
+    for line in text.splitlines():
+        m = re.match(r'^sql_queries_per_request_(sum|count)\{endpoint="([^"]*)"\} (\S+)$', line)
+        if m is not None:
+            values.setdefault(m.group(2), [0, 0])[0 if m.group(1) == "sum" else 1] = float(m.group(3))
+    return values
+
+def queries_per_request(before, after, endpoints):
+    # Between two scrapes of /admin/metrics. Workers write their counters
+    # at most once a second, the last requests of a flow may land in the
+    # next one
+    total = 0
+    count = 0
+    for endpoint in endpoints:
+        old = before.get(endpoint, [0, 0])
+        new = after.get(endpoint, [0, 0])
+        total += new[0] - old[0]
+        count += new[1] - old[1]
+    return round(total / count, 2) if count > 0 else None
+
+def run_server(settings_path, flows, requests, login_requests, workers, concurrency):
+    # "./run serve" in a child process, driven by concurrency threads each
+    # with its own cookie jar. SQL statements are read from /admin/metrics,
+    # where the server adds up the counters of its workers
+    import urllib.request, urllib.parse, urllib.error, http.cookiejar
+    from app import engine
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "APP_SETTINGS": settings_path,
+        "SERVER_BIND": "127.0.0.1:{}".format(port),
+        "SERVER_WORKERS": str(workers)
+    })
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT_PATH, "run"), "serve"], cwd=ROOT_PATH, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_port(port):
+            raise RuntimeError("Server didn't start on port {}".format(port))
+
+        def fetch(opener, method, path, form):
+            data = urllib.parse.urlencode(form).encode() if form is not None else None
+            req = urllib.request.Request("http://127.0.0.1:{}{}".format(port, path), data=data, method=method)
+            try:
+                with opener.open(req, timeout=60) as resp:
+                    resp.read()
+                    return resp.status
+            except urllib.error.HTTPError as e:
+                e.read()
+                return e.code
+            except OSError:
+                return 0
+
+        def new_opener():
+            return urllib.request.build_opener(NoRedirect, urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+        def endpoint(method, path):
+            try:
+                return engine.url_map.bind("127.0.0.1").match(path.split("?")[0], method=method)[0]
+            except Exception:
+                return None
+
+        # The seeded administrator reads the metrics
+        admin = new_opener()
+        fetch(admin, "POST", "/admin/login", {"login": "admin", "password": "123456"})
+
+        def scrape():
+            try:
+                with admin.open("http://127.0.0.1:{}/admin/metrics".format(port), timeout=60) as resp:
+                    return parse_queries(resp.read().decode())
+            except OSError:
+                return {}
+
+        # Sessions are kept across flows, the cart flows see the lines added
+        openers = [new_opener() for v in range(concurrency)]
+        results = {}
+        for name, flow in flows:
+            total = login_requests if name == "login" else requests
+            samples = []
+            endpoints = set()
+            lock = threading.Lock()
+            remaining = [total]
+
+            def worker(opener):
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                        steps = flow()
+                    if name == "login":
+                        opener = new_opener()
+                    for step, measured, method, path, form in steps:
+                        start = time.perf_counter()
+                        status = fetch(opener, method, path, form)
+                        if measured:
+                            with lock:
+                                samples.append((time.perf_counter() - start, status))
+                                endpoints.add(endpoint(method, path))
+
+            threads = [threading.Thread(target=worker, args=(v,)) for v in openers]
+            before = scrape()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            results[name] = summarize(samples, [], elapsed)
+            results[name]["queries_per_request"] = queries_per_request(before, scrape(), endpoints)
+    finally:
+        server.terminate()
+        server.wait(30)
+
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_PATH, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_bench(engine, db, size=1000, requests=200, login_requests=20, mode="client", workers=2, concurrency=8, seed=1, log=None):
+    from .initializedb import init_database
+
+    folder = tempfile.mkdtemp(prefix="ecommerce-bench-")
+    path = os.path.join(folder, "bench.db")
+    settings = bench_settings(path)
+    settings_path = os.path.join(folder, "settings.py")
+    with open(settings_path, "w") as f:
+        for key, value in settings.items():
+            f.write("{} = {!r}\n".format(key, value))
+
+    engine.config.update(settings)
+    from ..cache import clear_all
+    clear_all()
+
+    rng = random.Random(seed)
+    with engine.app_context():
+        init_database(db)
+        start = time.perf_counter()
+        products = seed_catalog(db, size, rng)
+        if log is not None:
+            log("Seeded {} products in {:.1f}s".format(len(products), time.perf_counter() - start))
+
+        flows = build_flows(products, rng)
+        results = {}
+        if mode in ("client", "both"):
+            results["client"] = run_client(engine, db, flows, requests, login_requests)
+        if mode in ("server", "both"):
+            db.session.remove()
+            results["server"] = run_server(settings_path, flows, requests, login_requests, workers, concurrency)
+
+    return {
+        "commit": git_commit(),
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "products": size,
+        "requests": requests,
+        "login_requests": login_requests,
+        "workers": workers,
+        "concurrency": concurrency,
+        "seed": seed,
+        "results": results
+    }
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import glob
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Elements whose text is kept line by line (script, style) or untouched
+RAW_TAGS = re.compile(r"<(script|style|pre|textarea)\b[^>]*>|</(script|style|pre|textarea)\s*>", re.I)
+# Conditional comments "<!--[if ...]>" are kept
+HTML_COMMENT = re.compile(r"<!--(?!\[).*?-->", re.S)
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+
+def minify_text(text, raw, before="", after=""):
+    if raw in ("pre", "textarea"):
+        return text
+    if raw in ("script", "style"):
+        # Only indentation and blank lines go, line breaks can end a JS
+        # statement. The ends of the text may continue a line around a
+        # template tag, they are kept
+        lines = text.split("\n")
+        kept = []
+        for number, line in enumerate(lines):
+            if number > 0:
+                line = line.lstrip()
+            if number < len(lines) - 1:
+                line = line.rstrip()
+            if line or number == 0 or number == len(lines) - 1:
+                kept.append(line)
+        return "\n".join(kept)
+
+    text = HTML_COMMENT.sub("", text)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r">\s+<", "><", text)
+    # Spaces next to a tag are dropped, next to a template tag they may
+    # separate words so one is kept
+    if before == ">" or text.lstrip().startswith("<"):
+        text = text.lstrip()
+    if after == "<" or text.rstrip().endswith(">"):
+        text = text.rstrip()
+    return text
+
+def minify_data(text, state):
+    out = []
+    pos = 0
+    for m in RAW_TAGS.finditer(text):
+        out.append(minify_text(text[pos:m.start()], state["raw"], ">" if pos > 0 else "", "<"))
+        out.append(m.group(0))
+        state["raw"] = m.group(1).lower() if m.group(1) else None
+        pos = m.end()
+    out.append(minify_text(text[pos:], state["raw"], ">" if pos > 0 else ""))
+    return "".join(out)
+
+def minify_template(source, env):
+    # Works on the Jinja token stream, template tags are copied as they are
+    # and only the text between them is minified, template comments go
+    state = {"raw": None}
+    out = []
+    for lineno, token, value in env.lexer.tokeniter(source, None):
+        if token == "data":
+            out.append(minify_data(value, state))
+        elif not token.startswith("comment"):
+            out.append(value)
+    return "".join(out).strip()
+
+def minify_css(source):
+    text = CSS_COMMENT.sub("", source)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    text = text.replace(";}", "}")
+    # Included as a template, "{#" would open a comment
+    return text.replace("{#", "{ #").strip()
+
+def build_templates(source, dest, log=None):
+    from jinja2 import Environment, TemplateSyntaxError
+
+    # Same delimiters as the application, trailing newlines kept so the
+    # token stream gives back the exact source
+    env = Environment(keep_trailing_newline=True)
+    os.makedirs(dest, exist_ok=True)
+    for path in glob.glob(os.path.join(dest, "*")):
+        if os.path.isfile(path):
+            os.remove(path)
+
+    count = 0
+    for path in sorted(glob.glob(os.path.join(source, "*.html")) + glob.glob(os.path.join(source, "*.css"))):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if not text.strip():
+            if log is not None:
+                log("File {} is empty content".format(path))
+            continue
+
+        minified = minify_css(text) if path.endswith(".css") else minify_template(text, env)
+        try:
+            env.parse(minified)
+        except TemplateSyntaxError as e:
+            if log is not None:
+                log("Kept {} as is, minified it doesn't parse: {}".format(path, e))
+            minified = text
+
+        with open(os.path.join(dest, os.path.basename(path)), "w", encoding="utf-8") as f:
+            f.write(minified)
+        count = count + 1
+
+    return count
+
+def compile_templates(engine):
+    # Loading every template once fills the bytecode cache, workers start
+    # without compiling anything
+    folder = engine.config["TEMPLATE_CACHE_DIR"]
+    if not folder:
+        return 0
+    if engine.jinja_env.bytecode_cache is None:
+        from jinja2 import FileSystemBytecodeCache
+        os.makedirs(folder, exist_ok=True)
+        engine.jinja_env.bytecode_cache = FileSystemBytecodeCache(folder)
+    names = engine.jinja_env.list_templates()
+    for name in names:
+        engine.jinja_env.get_template(name)
+    return len(names)
+
+def compress_static(folder):
+    from ..compression import available_encodings, compress, EXTENSIONS, COMPRESSIBLE, BEST
+
+    count = 0
+    for base, dirs, files in os.walk(folder):
+        for name in files:
+            if not name.lower().endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(base, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            for encoding in available_encodings():
+                target = path + EXTENSIONS[encoding]
+                if os.path.exists(target) and os.stat(target).st_mtime >= os.stat(path).st_mtime:
+                    continue
+                body = compress(data, encoding, BEST)
+                if len(body) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, "wb") as f:
+                    f.write(body)
+                count = count + 1
+
+    return count
+
+def build(engine, log=None):
+    templates = build_templates(os.path.join(ROOT_PATH, "tmpl"), os.path.join(engine.root_path, engine.template_folder), log)
+    compiled = compile_templates(engine)
+    compressed = compress_static(engine.static_folder)
+
+    return templates, compiled, compressed
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import io
+import contextlib
+import csv
+import json
+import gzip
+import sys
+from ..models.product import Product, notify_change
+
+FIELDS = ["name", "slug", "description", "image", "regular_price", "discounted_price", "stock"]
+INTEGERS = ["regular_price", "discounted_price", "stock"]
+
+def guess_format(path, fmt=None):
+    if fmt:
+        return fmt
+    if path.endswith(".gz"):
+        path = path[:-3]
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+def open_file(path, mode):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    if path.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(path, mode + "b"), encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+def read_rows(f, fmt):
+    if fmt == "jsonl":
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        for row in csv.DictReader(f):
+            yield row
+
+def clean_row(row):
+    # None for rows that can't be imported, they are counted as skipped.
+    # Only the columns present in the row are kept, an update leaves the
+    # other ones as they are
+    data = {}
+    for key in FIELDS:
+        if key not in row:
+            continue
+        value = row[key]
+        if key in INTEGERS:
+            try:
+                value = int(value) if value not in (None, "") else None
+            except (TypeError, ValueError):
+                return None
+        elif value is None:
+            value = ""
+        data[key] = value
+    if not data.get("slug") or data.get("name") == "":
+        return None
+    # Like the product form, an empty sale price is the regular price
+    if "discounted_price" in data and data["discounted_price"] is None:
+        data["discounted_price"] = data.get("regular_price")
+    return data
+
+def new_product(data):
+    # None when the row lacks the name, the other missing columns get the
+    # defaults of the product form
+    if not data.get("name"):
+        return None
+    values = dict((key, None if key in INTEGERS else "") for key in FIELDS)
+    values.update(data)
+    if values["discounted_price"] is None:
+        values["discounted_price"] = values["regular_price"]
+    return values
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def import_catalog(db, path, fmt=None, batch_size=1000, commit_every=50, defer_indexes=True):
+    # Upserts keyed on slug, one lookup query per batch, bulk inserts and
+    # updates, and a commit every commit_every batches
+    table = Product.__table__
+    deferred = [v for v in table.indexes if not v.unique] if defer_indexes else []
+    for index in deferred:
+        index.drop(db.engine)
+
+    inserted = 0
+    updated = 0
+    skipped = 0
+    try:
+        with open_file(path, "r") as f:
+            rows = read_rows(f, guess_format(path, fmt))
+            for number, batch in enumerate(batched(rows, batch_size), 1):
+                items = {}
+                for row in batch:
+                    data = clean_row(row)
+                    if data is None:
+                        skipped = skipped + 1
+                        continue
+                    items[data["slug"]] = data
+
+                existing = dict(db.session.query(Product.slug, Product.id).filter(Product.slug.in_(list(items))))
+                inserts = []
+                updates = []
+                for slug, data in items.items():
+                    if slug in existing:
+                        data["id"] = existing[slug]
+                        updates.append(data)
+                    else:
+                        data = new_product(data)
+                        if data is None:
+                            skipped = skipped + 1
+                            continue
+                        inserts.append(data)
+
+                if inserts:
+                    db.session.bulk_insert_mappings(Product, inserts)
+                if updates:
+                    db.session.bulk_update_mappings(Product, updates)
+                inserted = inserted + len(inserts)
+                updated = updated + len(updates)
+
+                if number % commit_every == 0:
+                    db.session.commit()
+            db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+    finally:
+        for index in deferred:
+            index.create(db.engine)
+
+    # Besides the caches of this process, the hooks bump the shared catalog
+    # version, the running workers drop their pages and prices at their
+    # next check
+    notify_change([], "import")
+
+    return inserted, updated, skipped
+
+def export_catalog(db, path, fmt=None, batch_size=1000):
+    # Streams rows from a server side cursor, memory stays flat
+    fmt = guess_format(path, fmt)
+    columns = [getattr(Product.__table__.c, v) for v in FIELDS]
+    query = db.select(columns).order_by(Product.__table__.c.id)
+    result = db.session.connection(execution_options={"stream_results": True}).execute(query)
+
+    count = 0
+    with open_file(path, "w") as f:
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if writer is not None:
+                    writer.writerow(["" if v is None else v for v in row])
+                else:
+                    f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n")
+            count = count + len(rows)
+    result.close()
+
+    return count
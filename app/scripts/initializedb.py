@@ -3,16 +3,24 @@
 from ..models.user import User
 from ..models.option import Option
 from ..models.product import Product
+from ..models.related import RelatedProduct
+from ..models.cart import CartItem
+from ..models.order import Order, OrderItem
+from .migrations import migrate
 
-def init_database(db):
-    db.drop_all()
-    db.create_all()
+def init_database(db, log=None):
+    # Brings the schema up to date, existing data is kept, and seeds the
+    # administrator on an empty database
+    done = migrate(db, log=log)
 
-    admin = User("admin")
-    admin.nickname ="Administrator"
-    admin.email = "admin@ecommerce.io"
-    admin.blocked = "n"
-    admin.role = "admin"
-    admin.set_password("123456")
+    if User.query.filter(User.role == "admin").count() == 0:
+        admin = User("admin")
+        admin.nickname ="Administrator"
+        admin.email = "admin@ecommerce.io"
+        admin.blocked = "n"
+        admin.role = "admin"
+        admin.set_password("123456")
 
-    admin.save()
+        admin.save()
+
+    return done
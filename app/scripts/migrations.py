@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+import time
+from app import db
+from sqlalchemy import inspect
+
+# Applied migrations, one row per version
+schema_version = db.Table("schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(255), nullable=False, default=''),
+    db.Column("applied", db.Integer, nullable=False, default=0)
+)
+
+# Ordered schema changes, each one runs once. The steps check what is
+# already there, so a database created by an older create_all or upgraded
+# by hand is picked up where it is
+_migrations = []
+
+def migration(version, description):
+    def wrapper(fn):
+        _migrations.append((version, description, fn))
+        _migrations.sort(key=lambda v: v[0])
+        return fn
+    return wrapper
+
+def create_tables(db, *names):
+    for name in names:
+        db.metadata.tables[name].create(db.engine, checkfirst=True)
+
+def add_column(db, column):
+    # Columns must be nullable or carry a server default, so adding them
+    # doesn't rewrite or lock the table, fill them with backfill() after
+    from sqlalchemy.schema import CreateColumn
+
+    table = column.table
+    if column.name in set(v["name"] for v in inspect(db.engine).get_columns(table.name)):
+        return False
+    ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+    db.session.execute("ALTER TABLE {} ADD COLUMN {}".format(table.name, ddl))
+    db.session.commit()
+    return True
+
+def create_index(db, index):
+    # PostgreSQL builds the index without blocking writes, which has to
+    # happen outside of a transaction
+    if index.name in set(v["name"] for v in inspect(db.engine).get_indexes(index.table.name)):
+        return False
+    db.session.commit()
+    if db.engine.dialect.name == "postgresql":
+        index.dialect_options["postgresql"]["concurrently"] = True
+        try:
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                index.create(conn)
+        finally:
+            index.dialect_options["postgresql"]["concurrently"] = False
+    else:
+        index.create(db.engine)
+    return True
+
+def backfill(db, table, values, where=None, batch_size=1000, pause=0):
+    # Updates rows in primary key order, one short transaction per batch so
+    # locks are released between them
+    count = 0
+    last = None
+    while True:
+        query = db.select([table.c.id]).order_by(table.c.id).limit(batch_size)
+        if where is not None:
+            query = query.where(where)
+        if last is not None:
+            query = query.where(table.c.id > last)
+        ids = [v[0] for v in db.session.execute(query)]
+        if not ids:
+            break
+        db.session.execute(table.update().where(table.c.id.in_(ids)).values(values))
+        db.session.commit()
+        count = count + len(ids)
+        last = ids[-1]
+        if pause:
+            time.sleep(pause)
+    return count
+
+def get_applied(db):
+    schema_version.create(db.engine, checkfirst=True)
+    return set(v[0] for v in db.session.execute(db.select([schema_version.c.version])))
+
+def pending_migrations(db):
+    applied = get_applied(db)
+    return [v for v in _migrations if v[0] not in applied]
+
+def migrate(db, target=None, log=None):
+    done = []
+    for version, description, fn in pending_migrations(db):
+        if target is not None and version > target:
+            break
+        if log is not None:
+            log("Applying {} {}".format(version, description))
+        try:
+            fn(db)
+            db.session.execute(schema_version.insert().values(version=version, description=description, applied=int(time.time())))
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        done.append(version)
+    return done
+
+@migration(1, "users, options and products")
+def initial_tables(db):
+    create_tables(db, "users", "options", "products")
+
+@migration(2, "product stock")
+def product_stock(db):
+    from ..models.product import Product
+    add_column(db, Product.__table__.c.stock)
+
+@migration(3, "related products")
+def related_products(db):
+    create_tables(db, "related_products")
+
+@migration(4, "cart items")
+def cart_items(db):
+    create_tables(db, "cart_items")
+
+@migration(5, "orders")
+def orders(db):
+    create_tables(db, "orders", "order_items")
+
+@migration(6, "product full-text search")
+def search_index(db):
+    from ..fulltext import create_search_index
+    create_search_index(db)
+
+@migration(7, "unique product slugs")
+def unique_slugs(db):
+    from ..models.product import Product
+    rename_duplicate_slugs(db)
+    for index in Product.__table__.indexes:
+        if index.name == "ix_products_slug":
+            create_index(db, index)
+
+def rename_duplicate_slugs(db):
+    # The unique slug index can't be built over duplicates, every copy but
+    # the oldest one gets its id appended
+    from ..models.product import Product
+
+    table = Product.__table__
+    duplicates = db.select([table.c.slug]).group_by(table.c.slug).having(db.func.count() > 1)
+    rows = db.session.execute(db.select([table.c.id, table.c.slug]).where(
+        table.c.slug.in_(duplicates)).order_by(table.c.slug, table.c.id)).fetchall()
+
+    seen = set()
+    for id, slug in rows:
+        if slug in seen:
+            db.session.execute(table.update().where(table.c.id == id).values(slug="{}-{}".format(slug, id)))
+        seen.add(slug)
+    db.session.commit()
+
+@migration(8, "related products token index")
+def related_tokens(db):
+    from ..models.related import index_tokens
+    create_tables(db, "product_tokens")
+    index_tokens()
+
+@migration(9, "cart expiry")
+def cart_expiry(db):
+    from ..models.cart import CartItem
+    add_column(db, CartItem.__table__.c.updated_at)
+    backfill_carts(db)
+    for index in CartItem.__table__.indexes:
+        if index.name == "ix_cart_items_updated_at":
+            create_index(db, index)
+
+def backfill_carts(db):
+    # Existing lines start their CART_TTL now
+    from ..models.cart import CartItem
+    table = CartItem.__table__
+    db.session.execute(table.update().where(table.c.updated_at == 0).values(updated_at=int(time.time())))
+    db.session.commit()
+
+@migration(10, "shared cache versions")
+def shared_versions(db):
+    # The counters of versions.py get their rows up front, so a bump never
+    # has to insert one next to other pending writes. The options registry
+    # used its own row before
+    from ..models.option import Option
+    from ..versions import PREFIX, NAMES
+
+    Option.query.filter(Option.name == "options_version").delete(synchronize_session=False)
+    for name in NAMES:
+        if Option.query.get(PREFIX + name) is None:
+            row = Option(PREFIX + name)
+            row.value = "0"
+            row.description = "Shared cache version"
+            db.session.add(row)
+    db.session.commit()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import os
+from app import engine, db
+
+def reset_after_fork():
+    # Workers start from a copy of the master, they must not share its
+    # database connections, pools or warmed caches
+    with engine.app_context():
+        db.engine.dispose()
+
+    from .cache import clear_all
+    clear_all()
+
+    from .models import cart, password
+    cart._store = None
+    password._pool = None
+    password._slots = None
+
+    from . import thumbnails
+    thumbnails._pool = None
+    thumbnails._inflight.clear()
+
+    from . import fulltext
+    fulltext._backend = None
+    fulltext._fallback.invalidate()
+
+    from . import metrics
+    metrics.reset()
+
+    from . import options
+    options.reset()
+
+    from . import versions
+    versions.reset()
+
+def post_fork(server, worker):
+    reset_after_fork()
+
+def worker_exit(server, worker):
+    # Counters recorded since the last write of the worker
+    from . import metrics
+    if engine.config["METRICS_DIR"] and metrics._name is not None:
+        metrics.dump()
+
+def worker_count():
+    return engine.config["SERVER_WORKERS"] or (os.cpu_count() or 1) * 2 + 1
+
+def split_limits(workers):
+    # Hashing processes and login attempts are counted per worker, their
+    # configured totals are shared out so the server as a whole keeps them
+    config = engine.config
+    if config["BCRYPT_WORKERS"] > 0:
+        config["BCRYPT_WORKERS"] = max(1, config["BCRYPT_WORKERS"] // workers)
+        config["BCRYPT_QUEUE_SIZE"] = config["BCRYPT_QUEUE_SIZE"] // workers
+    config["LOGIN_BURST"] = max(1, config["LOGIN_BURST"] // workers)
+    config["LOGIN_RATE"] = config["LOGIN_RATE"] / workers
+
+def get_options():
+    workers = worker_count()
+    threads = engine.config["SERVER_THREADS"]
+    return {
+        "bind": engine.config["SERVER_BIND"],
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "keepalive": engine.config["SERVER_KEEPALIVE"],
+        "timeout": engine.config["SERVER_TIMEOUT"],
+        "graceful_timeout": engine.config["SERVER_GRACEFUL_TIMEOUT"],
+        "max_requests": engine.config["SERVER_MAX_REQUESTS"],
+        "max_requests_jitter": engine.config["SERVER_MAX_REQUESTS"] // 10,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit
+    }
+
+def serve():
+    # Preforking server, "kill -HUP <master pid>" reloads the workers
+    # gracefully, finishing in-flight requests first
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is not installed, run: pip install gunicorn")
+        return
+
+    # Counters of all workers are added up through files, set before the
+    # workers fork so they all share the folder
+    if engine.config["METRICS"] and not engine.config["METRICS_DIR"]:
+        import tempfile
+        engine.config["METRICS_DIR"] = tempfile.mkdtemp(prefix="ecommerce-metrics-")
+
+    split_limits(worker_count())
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in get_options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return engine
+
+    Server().run()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from .models.product import on_change
+
+EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp"
+}
+
+_pool = None
+_inflight = {}
+_lock = threading.RLock()
+
+def thumbnail_name(filename, width, fmt=None):
+    # fmt None keeps the format of the source image
+    if fmt is None:
+        return "{}/{}".format(width, filename)
+    return "{}/{}{}".format(width, filename, EXTENSIONS[fmt])
+
+def make_thumbnail(source_folder, thumbnail_folder, filename, width, fmt, quality):
+    # Runs in the worker processes, only takes plain arguments
+    from PIL import Image
+    from werkzeug.security import safe_join
+
+    source = safe_join(source_folder, filename)
+    target = safe_join(thumbnail_folder, thumbnail_name(filename, width, fmt))
+    if source is None or target is None or not os.path.isfile(source):
+        return None
+
+    if os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return target
+
+    img = Image.open(source)
+    if fmt is None:
+        fmt = img.format
+    if img.width > width:
+        height = int(img.height * width / img.width)
+        img = img.resize((width, height), Image.LANCZOS)
+
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Written aside then renamed so readers never see a partial file
+    temp = "{}.{}.tmp".format(target, os.getpid())
+    img.save(temp, fmt, quality=quality)
+    os.replace(temp, target)
+
+    return target
+
+def get_pool():
+    global _pool
+    from app import engine
+    if engine.config["THUMBNAIL_WORKERS"] <= 0:
+        return None
+    with _lock:
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor(engine.config["THUMBNAIL_WORKERS"])
+    return _pool
+
+def shutdown_thumbnails():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _inflight.clear()
+
+def submit(filename, width, fmt):
+    from app import engine, UPLOAD_FOLDER, THUMBNAIL_FOLDER
+    args = (UPLOAD_FOLDER, THUMBNAIL_FOLDER, filename, width, fmt, engine.config["THUMBNAIL_QUALITY"])
+
+    pool = get_pool()
+    if pool is not None:
+        return pool.submit(make_thumbnail, *args)
+
+    from concurrent.futures import Future
+    future = Future()
+    try:
+        future.set_result(make_thumbnail(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def relay(name, source, future):
+    with _lock:
+        _inflight.pop(name, None)
+    if source.exception() is not None:
+        future.set_exception(source.exception())
+    else:
+        future.set_result(source.result())
+
+def get_thumbnail(filename, width, fmt):
+    # Single flight, concurrent requests for the same missing thumbnail
+    # wait on one resize instead of starting their own
+    from app import engine, THUMBNAIL_FOLDER
+    name = thumbnail_name(filename, width, fmt)
+    path = os.path.join(THUMBNAIL_FOLDER, name)
+    if os.path.isfile(path):
+        return name
+
+    # Only the placeholder is made under the lock, the resize runs after so
+    # misses of different images don't wait on each other
+    from concurrent.futures import Future
+    owner = False
+    with _lock:
+        future = _inflight.get(name)
+        if future is None:
+            future = _inflight[name] = Future()
+            owner = True
+
+    if owner:
+        try:
+            source = submit(filename, width, fmt)
+        except Exception as e:
+            source = Future()
+            source.set_exception(e)
+        source.add_done_callback(lambda f: relay(name, f, future))
+
+    if future.result(timeout=engine.config["THUMBNAIL_TIMEOUT"]) is None:
+        return None
+
+    return name
+
+def schedule_thumbnails(filenames):
+    from app import engine
+    futures = []
+    for filename in filenames:
+        for width in engine.config["THUMBNAIL_SIZES"]:
+            for fmt in [None] + engine.config["THUMBNAIL_FORMATS"]:
+                futures.append(submit(filename, width, fmt))
+    return futures
+
+@on_change
+def refresh_thumbnails(products, action):
+    if action == "remove":
+        return
+    schedule_thumbnails(set(v.image for v in products if v.image))
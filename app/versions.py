@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from app import engine, db
+from .models.option import Option
+
+# Counters shared by the workers through the options table. A writer bumps
+# one after its commit, every worker compares them at most once every
+# VERSION_CHECK_INTERVAL seconds and runs the callbacks watching the ones
+# that moved, so caches filled under an older value are dropped everywhere
+PREFIX = "version:"
+NAMES = ("catalog", "users", "options")
+
+_lock = threading.Lock()
+_values = None
+_checked = 0
+_watchers = {}
+
+def watch(name):
+    def wrapper(fn):
+        _watchers.setdefault(name, []).append(fn)
+        return fn
+    return wrapper
+
+def read_values():
+    rows = db.session.query(Option.name, Option.value).filter(Option.name.like(PREFIX + "%"))
+    return dict((name[len(PREFIX):], value) for name, value in rows)
+
+def check():
+    global _values, _checked
+    now = time.time()
+    with _lock:
+        if _values is not None and now - _checked < engine.config["VERSION_CHECK_INTERVAL"]:
+            return
+        # Other threads go on with the current values meanwhile
+        _checked = now
+    values = read_values()
+
+    with _lock:
+        old = _values
+        _values = values
+    if old is None:
+        return
+
+    for name, value in values.items():
+        if old.get(name) != value:
+            for fn in _watchers.get(name, []):
+                fn()
+
+def get(name):
+    return (_values or {}).get(name)
+
+def bump(name):
+    # Incremented by the database, concurrent writers never end on the
+    # same value. Pending writes of the session go in the same commit. The
+    # writer's own watchers run at its next check too
+    from sqlalchemy.exc import IntegrityError
+
+    key = PREFIX + name
+    for attempt in range(2):
+        count = Option.query.filter(Option.name == key).update({
+            Option.value: db.cast(db.cast(Option.value, db.Integer) + 1, db.Text)
+        }, synchronize_session=False)
+        if count == 0:
+            row = Option(key)
+            row.value = "1"
+            row.description = "Shared cache version"
+            db.session.add(row)
+        try:
+            db.session.commit()
+            return
+        except IntegrityError:
+            # Another worker created the row first
+            db.session.rollback()
+
+def reset():
+    global _values, _checked
+    with _lock:
+        _values = None
+        _checked = 0
+
+@engine.before_request
+def refresh_versions():
+    try:
+        check()
+    except:
+        # Before the options table exists nothing is shared
+        db.session.rollback()
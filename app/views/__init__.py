@@ -2,5 +2,6 @@
 
 __all__ = [
     "errors", "login", "logout", "static", "template",
-    "home", "dashboard", "product", "cart", "checkout"
+    "home", "dashboard", "product", "cart", "checkout", "search",
+    "catalog"
 ]
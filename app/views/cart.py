@@ -1,85 +1,220 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL, CART_COOKIE_NAME
-from flask import render_template, redirect, url_for, request
+from app import engine, CART_COOKIE_NAME
+from flask import render_template, redirect, url_for, request, jsonify
+from ..models.cart import get_cart_store
 
-def get_cart(req):
-    cookies = req.cookies.get(CART_COOKIE_NAME)
-    if not cookies:
-        return None
+def parse_legacy_cart(value):
+    # Carts saved by the old "id:qty|id:qty" cookie format
     cart_items = {}
-    a = cookies.strip().split("|")
-    for i in range(len(a)):
-        x = a[i].strip().split(":")
+    for x in value.strip().split("|"):
+        x = x.strip().split(":")
         if len(x) != 2:
             continue
         try:
             id = int(x[0])
+            quantity = int(x[1])
         except:
             continue
-        if id <= 0:
+        if id <= 0 or quantity <= 0:
             continue
-        cart_items[x[0]] = x[1]
+        cart_items[id] = quantity
+
+    return cart_items
+
+def set_cart_cookie(cookie):
+    from datetime import datetime
+    from flask import after_this_request
+
+    expiration = int(datetime.timestamp(datetime.now())) + 3600 * 24 * 30 * 12
+    expired = datetime.fromtimestamp(int(expiration))
+
+    @after_this_request
+    def save_cookie(resp):
+        resp.set_cookie(CART_COOKIE_NAME, cookie, expires=expired, httponly=True)
+        return resp
+
+def get_cart_token(req, create=False):
+    from flask import g
+    if "cart_token" in g:
+        return g.cart_token
+
+    from .common import new_cart_token, read_cart_token
+    cookie = req.cookies.get(CART_COOKIE_NAME)
+    token = read_cart_token(cookie)
+
+    if token is None and cookie and ":" in cookie:
+        cart_items = parse_legacy_cart(cookie)
+        if len(cart_items) > 0:
+            cookie = new_cart_token()
+            token = read_cart_token(cookie)
+            get_cart_store().replace(token, cart_items)
+            set_cart_cookie(cookie)
+
+    if token is None and create:
+        cookie = new_cart_token()
+        token = read_cart_token(cookie)
+        set_cart_cookie(cookie)
+
+    g.cart_token = token
+
+    return token
+
+def get_cart(req):
+    token = get_cart_token(req)
+    if token is None:
+        return None
+
+    return get_cart_store().get(token)
+
+def to_int(value, default=None):
+    try:
+        return int(value)
+    except:
+        return default
+
+def is_product(id):
+    from ..models.pricing import get_products
+    return id is not None and id > 0 and id in get_products([id])
+
+def cart_summary(cart_items):
+    from ..models.pricing import price_cart
+    cart = price_cart(cart_items)
+    return {
+        "count": cart["count"],
+        "total": cart["total"],
+        "regular_total": cart["regular_total"],
+        "discount": cart["discount"],
+        "total_text": cart["total_text"],
+        "items": [{
+            "id": v["id"],
+            "name": v["name"],
+            "slug": v["slug"],
+            "price": v["price"],
+            "discounted": v["discounted"],
+            "quantity": v["quantity"],
+            "subtotal": v["subtotal"],
+            "subtotal_text": v["subtotal_text"]
+        } for v in cart["items"]]
+    }
+
+def cart_response(cart_items, status="success", msg=None, code=200):
+    data = {"status": status, "cart": cart_summary(cart_items or {})}
+    if msg:
+        data["msg"] = msg
+    return jsonify(data), code
+
+def get_cart_data(req):
+    data = req.get_json(silent=True)
+    if isinstance(data, dict):
+        return data
+    return req.values
+
+@engine.route("/api/cart")
+def cart_api():
+    return cart_response(get_cart(request))
 
+def add_item(token, id, quantity):
+    # Adds to a checked product, capped at CART_MAX_QUANTITY
+    store = get_cart_store()
+    store.add(token, id, quantity)
+    cart_items = store.get(token)
+    if cart_items.get(id, 0) > engine.config["CART_MAX_QUANTITY"]:
+        cart_items[id] = engine.config["CART_MAX_QUANTITY"]
+        store.set(token, id, cart_items[id])
     return cart_items
 
-def cart_item_cookie(items):
-    vals = []
-    for id in items:
-        vals.append("{}:{}".format(id, items[id]))
+@engine.route("/api/cart/add", methods=['POST'])
+def cart_api_add():
+    data = get_cart_data(request)
+    id = to_int(data.get("id"))
+    quantity = to_int(data.get("quantity", 1))
+    if not is_product(id):
+        return cart_response(get_cart(request), "error", "Invalid product", 400)
+    if quantity is None or quantity <= 0:
+        return cart_response(get_cart(request), "error", "Invalid quantity", 400)
 
-    return "|".join(vals)
+    token = get_cart_token(request, create=True)
+    return cart_response(add_item(token, id, quantity))
+
+@engine.route("/api/cart/update", methods=['POST'])
+def cart_api_update():
+    data = get_cart_data(request)
+    id = to_int(data.get("id"))
+    quantity = to_int(data.get("quantity"))
+    if quantity is None:
+        return cart_response(get_cart(request), "error", "Invalid quantity", 400)
+
+    store = get_cart_store()
+    if quantity <= 0:
+        token = get_cart_token(request)
+        if token is not None and id is not None:
+            store.remove(token, id)
+    elif not is_product(id):
+        return cart_response(get_cart(request), "error", "Invalid product", 400)
+    else:
+        token = get_cart_token(request, create=True)
+        store.set(token, id, min(quantity, engine.config["CART_MAX_QUANTITY"]))
+
+    return cart_response(get_cart(request))
+
+@engine.route("/api/cart/remove", methods=['POST'])
+def cart_api_remove():
+    id = to_int(get_cart_data(request).get("id"))
+    token = get_cart_token(request)
+    if token is not None and id is not None:
+        get_cart_store().remove(token, id)
+
+    return cart_response(get_cart(request))
+
+@engine.route("/api/cart/set", methods=['POST'])
+def cart_api_set():
+    # {"items": {"<id>": <quantity>, ...}} for lines of the cart, a quantity
+    # of 0 removes the line, the cart is written once
+    items = get_cart_data(request).get("items")
+    if not isinstance(items, dict):
+        return cart_response(get_cart(request), "error", "Invalid items", 400)
+
+    changes = {}
+    for id, quantity in items.items():
+        id = to_int(id)
+        quantity = to_int(quantity)
+        if id is None or id <= 0 or quantity is None:
+            continue
+        changes[id] = quantity
+
+    token = get_cart_token(request)
+    if token is None:
+        return cart_response({})
+
+    from ..models.cart import update_cart
+    return cart_response(update_cart(token, changes))
 
 @engine.route("/cart", methods=['GET','POST'])
 def cart_page():
     if request.method == "POST":
-        cart_items = get_cart(request)
-        if cart_items is None:
-            cart_items = []
-        for id in cart_items:
-            try:
-                v = int(request.form.get('qty[{}]'.format(id),"0"))
-                if v > 0:
-                    cart_items[id] = "{}".format(v)
-                else:
-                    del cart_items[id]
-            except:
-                del cart_items[id]
-
-        cookie = cart_item_cookie(cart_items)
-        
-        from datetime import datetime
-        from flask import make_response
-        resp = make_response(redirect(url_for(".cart_page",updated="true")))
-
-        expiration = int(datetime.timestamp(datetime.now())) + 3600 * 24 * 30 * 12
-        expired = datetime.fromtimestamp(int(expiration))
-
-        resp.set_cookie(CART_COOKIE_NAME, cookie, expires=expired)
+        # "qty[<id>]" fields, lines without a field are left as they are
+        import re
+        changes = {}
+        for key, value in request.form.items():
+            m = re.match(r"^qty\[(\d+)\]$", key)
+            if m is None:
+                continue
+            quantity = to_int(value.strip())
+            if quantity is not None:
+                changes[int(m.group(1))] = quantity
 
-        return resp
+        token = get_cart_token(request)
+        if token is not None:
+            from ..models.cart import update_cart
+            update_cart(token, changes)
 
-    items = []
-    cart_items = get_cart(request)
-    if cart_items is not None:
-        ids = []
-        for id in cart_items:
-            ids.append(int(id))
-
-        if len(ids) > 0:
-            from ..models.product import Product
-            query = Product.query.filter(Product.id.in_(ids)).all()
-            items = [{
-                "id":v.id,
-                "name":v.name,
-                "slug":v.slug,
-                "image":v.image,
-                "price":v.regular_price,
-                "discounted":v.discounted_price,
-                "quantity": cart_items[str(v.id)] if str(v.id) in cart_items else 1
-            } for v in query ]
-
-    return render_template("cart.html", site_url=SITE_URL,items=items, cookie_cart=CART_COOKIE_NAME,page_id="cart")
+        return redirect(url_for(".cart_page",updated="true"))
+
+    from ..models.pricing import price_cart
+    cart = price_cart(get_cart(request))
+
+    return render_template("cart.html", items=cart["items"],cart=cart, cookie_cart=CART_COOKIE_NAME,page_id="cart")
 
 @engine.route("/addtocart",methods=['GET','POST'])
 def addtocart():
@@ -89,32 +224,19 @@ def addtocart():
     try:
         id = int(id)
     except:
-        pass
+        id = 0
 
-    if id <= 0:
+    if id <= 0 or not is_product(id):
         return redirect(url_for(".cart_page",add="invalid"))
 
-    cart_items = get_cart(request)
-    if cart_items is None:
-        cart_items = {}
+    token = get_cart_token(request, create=True)
+    cart_items = add_item(token, id, 1)
 
-    quantity = int(cart_items[str(id)]) if str(id) in cart_items else 0
-    quantity = quantity + 1
+    from .common import is_async
+    if is_async(request):
+        return cart_response(cart_items)
 
-    cart_items[str(id)] = "{}".format(quantity)
-
-    cookie = cart_item_cookie(cart_items)
-    
-    from datetime import datetime
-    from flask import make_response
-    resp = make_response(redirect(url_for(".cart_page",add="done")))
-
-    expiration = int(datetime.timestamp(datetime.now())) + 3600 * 24 * 30 * 12
-    expired = datetime.fromtimestamp(int(expiration))
-
-    resp.set_cookie(CART_COOKIE_NAME, cookie, expires=expired)
-
-    return resp
+    return redirect(url_for(".cart_page",add="done"))
 
 @engine.route("/remove", methods=['GET','POST'])
 def removeitem():
@@ -124,29 +246,17 @@ def removeitem():
     try:
         id = int(id)
     except:
-        pass
+        id = 0
 
     if id <= 0:
         return redirect(url_for(".cart_page",removed="invalid"))
 
-    cart_items = get_cart(request)
-    if cart_items is None:
-        return redirect(url_for(".cart_page",removed="done"))
-
-    if not (str(id) in cart_items):
-        return redirect(url_for(".cart_page",removed="done"))
-    # https://www.geeksforgeeks.org/python-ways-to-remove-a-key-from-dictionary/
-    del cart_items[str(id)]
-
-    from datetime import datetime
-    from flask import make_response
-    resp = make_response(redirect(url_for(".cart_page",removed="done")))
-
-    expiration = int(datetime.timestamp(datetime.now())) + 3600 * 24 * 30 * 12
-    expired = datetime.fromtimestamp(int(expiration))
-
-    cookie = cart_item_cookie(cart_items)
+    token = get_cart_token(request)
+    if token is not None:
+        get_cart_store().remove(token, id)
 
-    resp.set_cookie(CART_COOKIE_NAME, cookie, expires=expired)
+    from .common import is_async
+    if is_async(request):
+        return cart_response(get_cart(request))
 
-    return resp
+    return redirect(url_for(".cart_page",removed="done"))
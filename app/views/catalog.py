@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+from app import engine
+from flask import render_template, request, url_for, redirect
+
+MESSAGES = {
+    "1": ("success", "Product saved"),
+    "2": ("success", "Product removed"),
+    "3": ("success", "{} products updated"),
+    "4": ("success", "{} products removed"),
+    "5": ("warning", "No product selected"),
+    "6": ("error", "Invalid value"),
+    "7": ("error", "Product is not exists")
+}
+
+# Accepted uploads, extension to the formats Pillow may detect
+IMAGE_EXTENSIONS = {
+    ".jpg": ("JPEG",),
+    ".jpeg": ("JPEG",),
+    ".png": ("PNG",),
+    ".gif": ("GIF",),
+    ".webp": ("WEBP",)
+}
+
+def get_message(req):
+    msg = req.args.get("msg", "").strip()
+    if not (msg in MESSAGES):
+        return None
+    status, text = MESSAGES[msg]
+    return {
+        "status": status,
+        "msg": text.format(req.args.get("count", "0"))
+    }
+
+def check_admin():
+    # None when the admin may go on, otherwise the response to send. Posts
+    # must carry the CSRF token of the session
+    from .common import is_logged, check_csrf
+    user = is_logged(request)
+    if user is None:
+        return redirect(url_for(".admin_login", msg=1))
+    if user.role != "admin" or (request.method == "POST" and not check_csrf(request)):
+        from .errors import forbidden
+        return forbidden(None)
+    return None
+
+def to_price(value):
+    value = value.strip().replace(",", "")
+    if not value:
+        return None
+    value = int(value)
+    if value < 0:
+        raise ValueError(value)
+    return value
+
+def read_product_form(req):
+    # Returns the fields and the error message, if any
+    fields = {}
+    for key in ["name", "slug", "description", "image"]:
+        fields[key] = req.form.get(key, "").strip()
+    if not fields["slug"] and fields["name"]:
+        from unidecode import unidecode
+        import re
+        fields["slug"] = "-".join(re.findall(r"[a-z0-9]+", unidecode(fields["name"]).lower()))
+
+    try:
+        fields["regular_price"] = to_price(req.form.get("regular_price", ""))
+        fields["discounted_price"] = to_price(req.form.get("discounted_price", ""))
+        fields["stock"] = to_price(req.form.get("stock", ""))
+    except ValueError:
+        return fields, "Prices and stock must be positive numbers"
+
+    if fields["discounted_price"] is None:
+        fields["discounted_price"] = fields["regular_price"]
+
+    # The upload is saved by the caller once everything else is valid
+    upload = req.files.get("image_file")
+    if not fields["name"] or not fields["slug"] or not (fields["image"] or (upload is not None and upload.filename)):
+        return fields, "Please fill name, slug and image"
+
+    return fields, None
+
+def save_upload(upload):
+    # Checked to be an image, then named after its content so an upload
+    # never replaces the image of another product
+    import io
+    import os
+    import hashlib
+    from PIL import Image
+    from app import UPLOAD_FOLDER
+
+    ext = os.path.splitext(upload.filename)[1].lower()
+    if not (ext in IMAGE_EXTENSIONS):
+        return None
+    data = upload.read()
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.verify()
+    except:
+        return None
+    if not (img.format in IMAGE_EXTENSIONS[ext]):
+        return None
+
+    filename = hashlib.sha1(data).hexdigest()[:20] + ext
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(path):
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    return filename
+
+@engine.route("/admin/products")
+def admin_products():
+    resp = check_admin()
+    if resp is not None:
+        return resp
+
+    from ..models.product import Product
+    from .home import get_page_args
+
+    after, limit = get_page_args(request)
+    products, next_after = Product.page(after, limit)
+
+    return render_template("admin_products.html", products=products, next_after=next_after, limit=limit, args=get_message(request))
+
+@engine.route("/admin/products/new", methods=['GET','POST'])
+@engine.route("/admin/products/<int:id>", methods=['GET','POST'])
+def admin_product(id=None):
+    resp = check_admin()
+    if resp is not None:
+        return resp
+
+    from ..models.product import Product
+
+    product = None
+    if id is not None:
+        product = Product.query.get(id)
+        if product is None:
+            return redirect(url_for(".admin_products", msg=7))
+
+    args = get_message(request)
+    fields = {}
+    if product is not None:
+        for key in ["name", "slug", "description", "image", "regular_price", "discounted_price", "stock"]:
+            fields[key] = getattr(product, key)
+
+    if request.method == "POST":
+        fields, error = read_product_form(request)
+        if error is None:
+            other = Product.query.filter(Product.slug == fields["slug"]).first()
+            if other is not None and other is not product:
+                error = "Slug is used by another product"
+
+        upload = request.files.get("image_file")
+        if error is None and upload is not None and upload.filename:
+            fields["image"] = save_upload(upload)
+            if fields["image"] is None:
+                error = "Image must be a JPEG, PNG, GIF or WEBP file"
+
+        if error is not None:
+            args = {
+                "status": "error",
+                "msg": error
+            }
+        elif product is None:
+            product = Product()
+            for key, value in fields.items():
+                setattr(product, key, value)
+            product.save()
+            return redirect(url_for(".admin_product", id=product.id, msg=1))
+        else:
+            product.update(**fields)
+            return redirect(url_for(".admin_product", id=product.id, msg=1))
+
+    return render_template("admin_product.html", product=product, args=args, **fields)
+
+@engine.route("/admin/products/<int:id>/delete", methods=['POST'])
+def admin_product_delete(id):
+    resp = check_admin()
+    if resp is not None:
+        return resp
+
+    from ..models.product import Product
+    product = Product.query.get(id)
+    if product is None:
+        return redirect(url_for(".admin_products", msg=7))
+    product.remove()
+
+    return redirect(url_for(".admin_products", msg=2))
+
+@engine.route("/admin/products/bulk", methods=['POST'])
+def admin_products_bulk():
+    # One query loads the selection, one commit writes it and the change
+    # hooks run once for the whole batch. None of the actions touches a
+    # name or a description, the related lists are left alone
+    resp = check_admin()
+    if resp is not None:
+        return resp
+
+    ids = []
+    for v in request.form.getlist("ids"):
+        try:
+            ids.append(int(v))
+        except:
+            pass
+    if not ids:
+        return redirect(url_for(".admin_products", msg=5))
+
+    action = request.form.get("action", "").strip()
+    try:
+        value = int(request.form.get("value", "0").strip() or "0")
+    except:
+        value = None
+    if not (action == "delete" or (value is not None and (
+            (action == "price" and value > -100) or
+            (action == "sale" and 0 <= value < 100) or
+            (action == "stock" and value >= 0)))):
+        return redirect(url_for(".admin_products", msg=6))
+
+    from ..models.product import Product
+    from ..models.batch import batch
+
+    products = Product.query.filter(Product.id.in_(ids)).all()
+    with batch():
+        for v in products:
+            price = v.regular_price or 0
+            if action == "delete":
+                v.remove()
+            elif action == "price":
+                # Both prices move by value percent
+                v.update(regular_price=price * (100 + value) // 100,
+                    discounted_price=(v.discounted_price or 0) * (100 + value) // 100)
+            elif action == "sale":
+                # value percent off the regular price, 0 ends the sale
+                v.update(discounted_price=price * (100 - value) // 100)
+            else:
+                v.update(stock=value)
+
+    return redirect(url_for(".admin_products", msg=4 if action == "delete" else 3, count=len(products)))
@@ -1,31 +1,56 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL, CART_COOKIE_NAME
+from app import engine
 from flask import render_template, redirect, request, url_for
-from .cart import get_cart
+from .cart import get_cart, get_cart_token
 
 @engine.route("/checkout", methods=["GET","POST"])
 def checkout_page():
-    items = []
+    order = request.args.get("order", "").strip()
+    if order:
+        args = {
+            "status": "success",
+            "msg": "Your order #{} is placed".format(order)
+        }
+        return render_template("checkout.html", items=[], args=args)
+
     cart_items = get_cart(request)
     if cart_items is None:
         return redirect(url_for(".homepage"))
 
-    ids = []
-    for id in cart_items:
-        ids.append(int(id))
-
-    if len(ids) > 0:
-        from ..models.product import Product
-        query = Product.query.filter(Product.id.in_(ids)).all()
-        items = [{
-            "id":v.id,
-            "name":v.name,
-            "slug":v.slug,
-            "image":v.image,
-            "price":v.regular_price,
-            "discounted":v.discounted_price,
-            "quantity": cart_items[str(v.id)] if str(v.id) in cart_items else 1
-        } for v in query ]
-
-    return render_template("checkout.html", site_url=SITE_URL,items=items)
+    from ..models.pricing import price_cart
+
+    args = None
+    fields = {}
+    if request.method == "POST":
+        for key in ["fullname", "email", "telephone", "address", "payment", "description"]:
+            fields[key] = request.form.get(key, "").strip()
+        if not (fields["payment"] in ["cash", "online"]):
+            fields["payment"] = "cash"
+
+        cart = price_cart(cart_items, fresh=True)
+        if len(cart["items"]) == 0:
+            return redirect(url_for(".cart_page"))
+
+        if not fields["fullname"] or not fields["telephone"] or not fields["address"]:
+            args = {
+                "status": "warning",
+                "msg": "Please fill your name, telephone and address"
+            }
+        else:
+            from ..models.order import place_order, OutOfStock
+            try:
+                order = place_order(cart, fields)
+            except OutOfStock:
+                args = {
+                    "status": "error",
+                    "msg": "Some products are out of stock, please update your cart"
+                }
+            else:
+                from ..models.cart import get_cart_store
+                get_cart_store().clear(get_cart_token(request))
+                return redirect(url_for(".checkout_page", order=order.id))
+    else:
+        cart = price_cart(cart_items)
+
+    return render_template("checkout.html", items=cart["items"],cart=cart,args=args,**fields)
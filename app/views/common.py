@@ -1,11 +1,50 @@
 # -*- coding: utf-8 -*-
 
+import threading
+
 def hash_mac(data, key=None):
     if key is None or not key:
         from app import AUTH_KEY
         key = AUTH_KEY
     import hmac
-    return hmac.new(data.encode(), key.encode()).hexdigest()
+    # MD5 was the implicit digest before Python 3.8, keeps issued cookies valid
+    return hmac.new(data.encode(), key.encode(), "md5").hexdigest()
+
+def new_cart_token():
+    # 12 random bytes + 8 bytes of signature, 27 characters once encoded
+    import os
+    return sign_cart_token(os.urandom(12))
+
+def sign_cart_token(raw):
+    import hmac, hashlib, base64
+    from app import AUTH_KEY
+    sig = hmac.new(AUTH_KEY.encode(), raw, hashlib.sha256).digest()[:8]
+    return base64.urlsafe_b64encode(raw + sig).decode().rstrip("=")
+
+def read_cart_token(value):
+    # Returns the store key of a well signed token, None otherwise
+    if not value or len(value) != 27:
+        return None
+    import hmac, base64, binascii
+    try:
+        data = base64.urlsafe_b64decode(value + "=")
+    except (ValueError, binascii.Error):
+        return None
+    if not hmac.compare_digest(sign_cart_token(data[:12]), value):
+        return None
+    return binascii.hexlify(data[:12]).decode()
+
+def csrf_token(req):
+    # Signed from the auth cookie, another site can read neither of them
+    import hmac, hashlib
+    from app import AUTH_KEY, AUTH_COOKIE_NAME
+    cookie = req.cookies.get(AUTH_COOKIE_NAME, "")
+    return hmac.new(AUTH_KEY.encode(), "csrf|{}".format(cookie).encode(), hashlib.sha256).hexdigest()
+
+def check_csrf(req):
+    import hmac
+    token = req.form.get("csrf_token", "") or req.headers.get("X-CSRF-Token", "")
+    return hmac.compare_digest(token, csrf_token(req))
 
 def is_email(email):
     email = email.strip()
@@ -17,6 +56,32 @@ def is_email(email):
         return True
     return False
 
+_buckets = None
+_buckets_lock = threading.Lock()
+
+def throttle(key):
+    # Token bucket, LOGIN_BURST attempts then LOGIN_RATE attempts per second
+    global _buckets
+    from app import engine
+    rate = engine.config["LOGIN_RATE"]
+    burst = engine.config["LOGIN_BURST"]
+    with _buckets_lock:
+        if _buckets is None:
+            from app.cache import LRUCache
+            _buckets = LRUCache(100000, burst / rate)
+
+    import time
+    now = time.time()
+    with _buckets.lock:
+        tokens, stamp = _buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - stamp) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens = tokens - 1
+        _buckets.set(key, (tokens, now))
+
+    return allowed
+
 def is_async(req):
     request_xhr_key = req.headers.get('X-Requested-With')
     if request_xhr_key and request_xhr_key.lower() == 'xmlhttprequest':
@@ -24,6 +89,17 @@ def is_async(req):
     return False
 
 def is_logged(req):
+    # Memoized for the request, the same check runs several times per page
+    from flask import g
+    if not ("auth_user" in g):
+        g.auth_user = check_login(req)
+    return g.auth_user
+
+def is_admin(req):
+    user = is_logged(req)
+    return user is not None and user.role == "admin"
+
+def check_login(req):
     from app import AUTH_COOKIE_NAME
     _auth_cookie = req.cookies.get(AUTH_COOKIE_NAME)
     if not _auth_cookie:
@@ -38,15 +114,18 @@ def is_logged(req):
     if _expired and int(_expired) < int(time.time()):
         return None
 
+    from ..models.user import User, get_session, set_session
+    _user = get_session(_auth_cookie)
+    if _user is not None:
+        return _user
+
     _key = hash_mac(_eles[0] + "|" +  _expired)
     _hash = hash_mac(_eles[0] + "|" + _expired, _key)
     if _hash != _eles[2]:
         return None
 
-    from ..models.user import User
     _user = User.query.filter(User.username == _eles[0]).first()
-    if not bool(_user):
+    if not bool(_user) or _user.is_blocked():
         return None
 
-    return _user
-
+    return set_session(_auth_cookie, _user)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL
-from flask import render_template, request, url_for, redirect
+from app import engine
+from flask import render_template, request, url_for, redirect, make_response
 
 @engine.route("/admin/")
 def dashboard():
@@ -11,4 +11,50 @@ def dashboard():
     if user is None:
         return redirect(url_for('.admin_login',msg=1))
 
-    return render_template("dashboard.html", site_url=SITE_URL)
+    return render_template("dashboard.html")
+
+@engine.route("/admin/metrics")
+def admin_metrics():
+    from .common import is_admin
+    if not is_admin(request):
+        from .errors import forbidden
+        return forbidden(None)
+
+    from ..metrics import render_metrics
+    response = make_response(render_metrics())
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return response
+
+@engine.route("/admin/settings", methods=['GET','POST'])
+def admin_settings():
+    from .catalog import check_admin
+    resp = check_admin()
+    if resp is not None:
+        return resp
+
+    from ..options import get_options, set_options, delete_option
+
+    if request.method == "POST":
+        name = request.form.get("delete", "").strip()
+        if name:
+            delete_option(name)
+            return redirect(url_for('.admin_settings',msg=2))
+
+        values = {}
+        for key, value in request.form.items():
+            if key.startswith("option[") and key.endswith("]"):
+                values[key[7:-1]] = value.strip()
+        name = request.form.get("name", "").strip()
+        if name:
+            values[name] = request.form.get("value", "").strip()
+        set_options(values)
+        return redirect(url_for('.admin_settings',msg=1))
+
+    args = None
+    msg = request.args.get("msg", "").strip()
+    if msg == "1":
+        args = {"status": "success", "msg": "Settings saved"}
+    elif msg == "2":
+        args = {"status": "success", "msg": "Setting removed"}
+
+    return render_template("admin_settings.html", settings=sorted(get_options().items()), args=args)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL
+from app import engine
 from flask import render_template, make_response
 
 @engine.errorhandler(404)
@@ -9,7 +9,6 @@ def not_found(err):
         render_template(
             "error.html",
             title="Not Found",
-            site_url=SITE_URL,
             msg="404 Not Found"
         ),
         404
@@ -21,7 +20,6 @@ def bad_request(err):
         render_template(
             "error.html",
             title="Bad Request",
-            site_url=SITE_URL,
             msg="400 Bad Requested"
         ),
         400
@@ -33,7 +31,6 @@ def server_error(err):
         render_template(
             "error.html",
             title="Internal Server Error",
-            site_url=SITE_URL,
             msg="500 Internal Server Error"
         ),
         500
@@ -45,7 +42,6 @@ def not_allowed(err):
         render_template(
             "error.html",
             title="Method Not Allowed",
-            site_url=SITE_URL,
             msg="405 Method Not Allowed"
         ),
         405
@@ -57,7 +53,6 @@ def forbidden(err):
         render_template(
             "error.html",
             title="Forbidden",
-            site_url=SITE_URL,
             msg="403 Forbidden"
         ),
         403
@@ -1,14 +1,56 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL
-from flask import render_template
+from app import engine
+from flask import render_template, request, jsonify
+
+def get_page_args(req):
+    try:
+        after = int(req.args.get("after", "0").strip() or "0")
+    except:
+        after = 0
+    if after < 0:
+        after = 0
+
+    limit = engine.config["PRODUCTS_PER_PAGE"]
+    try:
+        limit = int(req.args.get("limit", limit))
+    except:
+        pass
+    limit = max(1, min(limit, engine.config["PRODUCTS_MAX_PER_PAGE"]))
+
+    return after, limit
 
 @engine.route("/")
 def homepage():
     from ..models.product import Product
 
-    products = Product.query.all()
-
+    from ..pagecache import cached_page
     from app import CART_COOKIE_NAME
 
-    return render_template("index.html", site_url=SITE_URL, products=products, cookie_cart=CART_COOKIE_NAME)
+    after, limit = get_page_args(request)
+
+    def render():
+        products, next_after = Product.page(after, limit)
+        return render_template("index.html", products=products, next_after=next_after, limit=limit, cookie_cart=CART_COOKIE_NAME)
+
+    return cached_page(("home", after, limit), render)
+
+@engine.route("/api/products")
+def products_api():
+    from ..models.product import Product
+
+    after, limit = get_page_args(request)
+    products, next_after = Product.page(after, limit)
+
+    return jsonify({
+        "items": [{
+            "id": v.id,
+            "name": v.name,
+            "slug": v.slug,
+            "image": v.image,
+            "price": v.regular_price,
+            "discounted": v.discounted_price
+        } for v in products],
+        "html": render_template("product_item.html", products=products),
+        "next": next_after
+    })
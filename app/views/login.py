@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL
+from app import engine
 from flask import render_template, request
 from flask import redirect, url_for
 
 @engine.route("/login", methods=['GET', 'POST'])
 def login():
-    return render_template("login.html", site_url=SITE_URL)
+    return render_template("login.html")
 
 @engine.route("/admin/login", methods=['GET','POST'])
 def admin_login():
@@ -23,8 +23,13 @@ def admin_login():
         if (not login) and (not password):
             return redirect(url_for('.admin_login',msg=1))
 
+        from .common import throttle
+        if not throttle("ip:{}".format(request.remote_addr)) or not throttle("user:{}".format(login.lower())):
+            return redirect(url_for(".admin_login", msg=6))
+
         from .common import is_email
         from ..models.user import User
+        from ..models.password import PasswordBusy
 
         code = 2
         if is_email(login):
@@ -36,8 +41,11 @@ def admin_login():
         if not bool(user):
             return redirect(url_for(".admin_login", msg=code))
 
-        if not user.check_password(password):
-            return redirect(url_for(".admin_login", msg=4))
+        try:
+            if not user.check_password(password):
+                return redirect(url_for(".admin_login", msg=4))
+        except PasswordBusy:
+            return redirect(url_for(".admin_login", msg=7))
 
         if user.is_blocked():
             return redirect(url_for(".admin_login", msg=5))
@@ -63,7 +71,7 @@ def admin_login():
             expired = datetime.fromtimestamp(int(expiration))
 
         from app import AUTH_COOKIE_NAME
-        resp.set_cookie(AUTH_COOKIE_NAME, _cookie, expires=expired)
+        resp.set_cookie(AUTH_COOKIE_NAME, _cookie, expires=expired, httponly=True, samesite="Lax")
 
         return resp
 
@@ -83,6 +91,11 @@ def admin_login():
             msg = "Password is not matched"
         elif msg == "5":
             msg = "Account is blocked"
+        elif msg == "6":
+            msg = "Too many login attempts, try again later"
+        elif msg == "7":
+            state = "warning"
+            msg = "Server is busy, try again later"
 
         args = {
             "status": state,
@@ -96,4 +109,4 @@ def admin_login():
             "msg": "Your are logout"
         }
 
-    return render_template("auth.html", site_url=SITE_URL, args=args)
+    return render_template("auth.html", args=args)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL
+from app import engine
 from flask import make_response, redirect, url_for, request
 
 @engine.route("/logout")
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from app import engine, SITE_URL, CART_COOKIE_NAME
+from app import engine, CART_COOKIE_NAME
 from flask import render_template
 
 @engine.route("/product/<string:name>/")
@@ -12,14 +12,16 @@ def detail_product(name=""):
 
     from ..models.product import Product
 
-    product = Product.query.filter(Product.slug == name).first()
+    product = Product.get_by_slug(name)
     if not bool(product):
         from .errors import not_found
         return not_found(None)
 
-    product.description = product.description.strip()
+    from ..pagecache import cached_page
 
-    from app import db
-    others = Product.query.filter(Product.id != product.id).order_by(db.func.random()).limit(5).all()
+    def render():
+        from ..models.related import get_related
+        others = get_related(product)
+        return render_template('product.html', product=product, description=product.description.strip(), others=others, cookie_cart=CART_COOKIE_NAME)
 
-    return render_template('product.html', site_url=SITE_URL, product=product, others=others, cookie_cart=CART_COOKIE_NAME)
+    return cached_page(("product", product.id), render)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from app import engine, CART_COOKIE_NAME
+from flask import render_template, request, jsonify
+
+def get_search_args(req):
+    q = req.args.get("q", "").strip()[:100]
+    try:
+        page = max(1, int(req.args.get("page", "1")))
+    except:
+        page = 1
+    limit = engine.config["PRODUCTS_PER_PAGE"]
+    try:
+        limit = int(req.args.get("limit", limit))
+    except:
+        pass
+    limit = max(1, min(limit, engine.config["PRODUCTS_MAX_PER_PAGE"]))
+
+    return q, page, limit
+
+@engine.route("/search")
+def search_page():
+    from ..fulltext import search_products
+
+    q, page, limit = get_search_args(request)
+    products, has_more = [], False
+    if q:
+        products, has_more = search_products(q, page, limit)
+
+    return render_template("search.html", q=q, page=page, limit=limit, products=products, has_more=has_more, cookie_cart=CART_COOKIE_NAME)
+
+@engine.route("/api/search")
+def search_api():
+    from ..fulltext import search_products
+
+    q, page, limit = get_search_args(request)
+    products, has_more = [], False
+    if q:
+        products, has_more = search_products(q, page, limit)
+
+    return jsonify({
+        "items": [{
+            "id": v.id,
+            "name": v.name,
+            "slug": v.slug,
+            "image": v.image,
+            "price": v.regular_price,
+            "discounted": v.discounted_price
+        } for v in products],
+        "page": page,
+        "next": page + 1 if has_more else None
+    })
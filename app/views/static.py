@@ -1,56 +1,90 @@
 # -*- coding: utf-8 -*-
 
 from app import engine, IMAGE_FOLDER
-from flask import send_from_directory
+from flask import send_from_directory, request
+
+def send_encoded(directory, filename):
+    # Precompressed variants written by "./run build" are sent as they
+    # are, nothing is compressed per request
+    from ..compression import accepted_encodings, EXTENSIONS, COMPRESSIBLE
+    from werkzeug.exceptions import NotFound
+
+    if filename.lower().endswith(COMPRESSIBLE):
+        import mimetypes
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding in accepted_encodings(request):
+            try:
+                resp = send_from_directory(directory, filename + EXTENSIONS[encoding], mimetype=mimetype)
+            except NotFound:
+                continue
+            resp.headers["Content-Encoding"] = encoding
+            resp.vary.add("Accept-Encoding")
+            return resp, encoding
+
+    return send_from_directory(directory, filename), None
+
+def send_cached(directory, filename, version):
+    resp, encoding = send_encoded(directory, filename)
+    if version is None:
+        return resp
+    # The content hash is a strong validator, one per encoding, and a URL
+    # carrying the current hash can never change so it is cached for a year
+    if encoding is not None:
+        resp.set_etag("{}-{}".format(version, encoding))
+    else:
+        resp.set_etag(version)
+    if request.args.get("v") == version:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = 31536000
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = True
+
+    return resp.make_conditional(request)
 
 @engine.route('/images/<path:filename>')
 def image_static(filename):
-    return send_from_directory(IMAGE_FOLDER, filename)
+    from ..manifest import file_hash
+    return send_cached(IMAGE_FOLDER, filename, file_hash("images", filename))
 
 @engine.route('/products/<path:filename>')
 def product_image_static(filename):
     from app import UPLOAD_FOLDER
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    from ..manifest import file_hash
+    return send_cached(UPLOAD_FOLDER, filename, file_hash("products", filename))
 
 @engine.route('/thumbnail/<path:filename>')
 def w500_image(filename):
-    import os
-    from app import THUMBNAIL_FOLDER, UPLOAD_FOLDER
-    if os.path.isfile(THUMBNAIL_FOLDER + filename):
-        return send_from_directory(THUMBNAIL_FOLDER, filename)
+    return thumbnail_image(engine.config["THUMBNAIL_DEFAULT_SIZE"], filename)
 
-    filepath = UPLOAD_FOLDER + '/' + filename
-    if os.path.isfile(filepath):
-        try:
-            from PIL import Image
-            img = Image.open(filepath)
-            width, height = img.size
-            new_width = 500
-            if width == new_width:
-                return send_from_directory(filepath)
-
-            percent = (new_width / width)
-            new_height = (height * percent)
-
-            _format = img.format
-            _mimetype = img.get_format_mimetype()
-
-            img = img.resize((new_width, int(new_height)), Image.ANTIALIAS)
+@engine.route('/thumbnail/<int:width>/<path:filename>')
+def thumbnail_image(width, filename):
+    from app import THUMBNAIL_FOLDER
+    from .errors import not_found
 
-            """
-            if int(new_height) > 314:
-                img = img.crop((0, 0, new_width, 314))
-            """
+    if not (width in engine.config["THUMBNAIL_SIZES"]):
+        return not_found(None)
 
-            thumbpath = THUMBNAIL_FOLDER + '/' + filename
+    # "name.jpg.webp" is the WebP variant of "name.jpg"
+    from ..thumbnails import EXTENSIONS
+    fmt = None
+    for f in engine.config["THUMBNAIL_FORMATS"]:
+        ext = EXTENSIONS[f]
+        if filename.endswith(ext) and len(filename) > len(ext):
+            fmt = f
+            filename = filename[:-len(ext)]
+            break
 
-            os.makedirs(os.path.dirname(thumbpath), exist_ok=True)
-            img.save(thumbpath, _format)
+    from ..thumbnails import get_thumbnail
+    try:
+        name = get_thumbnail(filename, width, fmt)
+    except:
+        name = None
 
-            return send_from_directory(THUMBNAIL_FOLDER , filename)
-        except:
-            from .errors import not_found
-            return not_found(None)
+    if name is None:
+        return not_found(None)
 
-    from .errors import not_found
-    return not_found(None)
+    # Thumbnails are derived from the source image, they share its version
+    from ..manifest import file_hash
+    return send_cached(THUMBNAIL_FOLDER, name, file_hash("products", filename))
@@ -1,10 +1,55 @@
 # -*- coding: utf-8 -*-
 
 from app import engine
+from app.cache import LRUCache
 from flask import Markup
 import markdown
 
+# Rendered HTML keyed by the hash of its source, an edited description
+# gets a new key so nothing needs invalidating
+_rendered = LRUCache(engine.config["MARKDOWN_CACHE_SIZE"])
+
 @engine.template_filter('markdown')
 def neomarkdown(markdown_content):
-    # https://stackoverflow.com/a/53694635
-    return Markup(markdown.markdown(markdown_content, extensions=['tables']))
+    import hashlib
+    key = hashlib.sha1(markdown_content.encode()).digest()
+    html = _rendered.get(key)
+    if html is None:
+        # https://stackoverflow.com/a/53694635
+        html = _rendered.set(key, Markup(markdown.markdown(markdown_content, extensions=['tables'])))
+    return html
+
+@engine.template_global()
+def image_url(filename):
+    from flask import url_for
+    from ..manifest import file_hash
+    return url_for(".image_static", filename=filename, v=file_hash("images", filename))
+
+@engine.template_global()
+def product_image_url(filename):
+    from flask import url_for
+    from ..manifest import file_hash
+    return url_for(".product_image_static", filename=filename, v=file_hash("products", filename))
+
+@engine.template_global()
+def thumbnail_url(filename, width=None, fmt=None):
+    from flask import url_for
+    from ..manifest import file_hash
+    from ..thumbnails import EXTENSIONS
+    if width is None:
+        width = engine.config["THUMBNAIL_DEFAULT_SIZE"]
+    version = file_hash("products", filename)
+    if fmt is not None:
+        filename = filename + EXTENSIONS[fmt]
+    return url_for(".thumbnail_image", width=width, filename=filename, v=version)
+
+@engine.template_global()
+def product_prices(product):
+    from ..models.pricing import display_prices
+    return display_prices(product)
+
+@engine.template_global()
+def csrf_token():
+    from flask import request
+    from .common import csrf_token as session_token
+    return session_token(request)
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+# Used when gunicorn is started by hand instead of "./run serve"
+from app.server import get_options
+
+globals().update(get_options())
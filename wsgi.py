@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+# WSGI entry point, e.g. gunicorn -c gunicorn.conf.py wsgi:application
+from app import engine as application